@@ -4,7 +4,11 @@ Auto-capture poker game screenshots using iOS Simulator
 Simulates gameplay and captures screenshots at different states
 """
 
+import bisect
+import shutil
 import subprocess
+import signal
+import sys
 import time
 import os
 
@@ -12,146 +16,270 @@ DEVICE_ID = "4502FBC7-E7FA-4F70-8040-4B5844B6AEDA"
 OUTPUT_DIR = "/Users/mehmetimga/ai-campions/visual-llm-yolo-sam3-testing/services/detector/training_data/poker_images"
 SCREENSHOT_COUNT = 0
 
+# --video: record the whole session once and sample frames afterwards
+VIDEO_MODE = "--video" in sys.argv
+VIDEO_FPS = 2
+# (seconds since recording start, state name or None for an input) for --video
+_RECORD_START = None
+_SESSION_EVENTS = []
+
+# idb talks to a long-lived idb_companion and taps in device points; osascript is the fallback
+USE_IDB = shutil.which("idb") is not None
+
+# Long-running interactive osascript; one interpreter serves every tap/keystroke
+_OSASCRIPT = None
+# Echoed after each batch of statements so applescript() can wait for them to finish
+_OSASCRIPT_SENTINEL = "__osascript_done__"
+
+def mark(state=None):
+    """Log a state (or, with None, an input) at the current recording time"""
+    if VIDEO_MODE and _RECORD_START is not None:
+        _SESSION_EVENTS.append((time.monotonic() - _RECORD_START, state))
+
+def idb(*args: str):
+    """Run an idb command against the simulator"""
+    mark()
+    subprocess.run(
+        ["idb", *args, "--udid", DEVICE_ID],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+def applescript(*lines: str):
+    """Run one-line AppleScript statements in the shared interpreter (blocks until done)"""
+    global _OSASCRIPT
+    mark()
+    if _OSASCRIPT is None or _OSASCRIPT.poll() is not None:
+        _OSASCRIPT = subprocess.Popen(
+            ["osascript", "-i"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    for line in lines:
+        _OSASCRIPT.stdin.write(line + "\n")
+    # The REPL echoes the sentinel only after the statements above have run
+    _OSASCRIPT.stdin.write(f'"{_OSASCRIPT_SENTINEL}"\n')
+    _OSASCRIPT.stdin.flush()
+    while True:
+        line = _OSASCRIPT.stdout.readline()
+        if not line or _OSASCRIPT_SENTINEL in line:
+            break
+
+def close_applescript():
+    """Shut down the shared osascript interpreter"""
+    global _OSASCRIPT
+    if _OSASCRIPT is not None:
+        _OSASCRIPT.stdin.close()
+        _OSASCRIPT.wait(timeout=5)
+        _OSASCRIPT = None
+
+def start_recording(video_path: str) -> subprocess.Popen:
+    """Start a hardware-encoded H.264 recording of the simulator screen"""
+    global _RECORD_START
+    _RECORD_START = time.monotonic()
+    return subprocess.Popen(
+        ["xcrun", "simctl", "io", DEVICE_ID, "recordVideo", "--codec=h264", "--force", video_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+def stop_recording(recorder: subprocess.Popen):
+    """Stop recording; simctl finalizes the file on SIGINT"""
+    recorder.send_signal(signal.SIGINT)
+    recorder.wait(timeout=30)
+
+def extract_frames(video_path: str, prefix: str) -> int:
+    """
+    Sample frames from the recording at VIDEO_FPS into OUTPUT_DIR
+    
+    Each frame is named after the state shown at its timestamp
+    (<state>_<prefix>_NNN.jpg), like screenshot() names its files, so the
+    filename-based labelers still work. Frames taken between an input and
+    the next state mark show a transition and are dropped.
+    """
+    pattern = os.path.join(OUTPUT_DIR, f"{prefix}_%03d.jpg")
+    subprocess.run([
+        "ffmpeg", "-loglevel", "error", "-i", video_path,
+        "-vf", f"fps={VIDEO_FPS}", "-qscale:v", "3", pattern
+    ], check=True)
+    
+    event_times = [t for t, _ in _SESSION_EVENTS]
+    kept = 0
+    frames = sorted(f for f in os.listdir(OUTPUT_DIR) if f.startswith(prefix + "_") and f.endswith(".jpg"))
+    for frame in frames:
+        index = int(frame[len(prefix) + 1:-len(".jpg")])
+        pos = bisect.bisect_right(event_times, (index - 1) / VIDEO_FPS) - 1
+        state = _SESSION_EVENTS[pos][1] if pos >= 0 else None
+        src = os.path.join(OUTPUT_DIR, frame)
+        if state is None:
+            os.remove(src)
+            continue
+        os.replace(src, os.path.join(OUTPUT_DIR, f"{state}_{frame}"))
+        kept += 1
+    return kept
+
 def screenshot(name: str):
-    """Capture a screenshot"""
+    """Capture a screenshot (JPEG encodes much faster than PNG)"""
     global SCREENSHOT_COUNT
+    if VIDEO_MODE:
+        # Frames come from the session recording instead; mark which state they show
+        mark(name)
+        print(f"📍 State: {name}")
+        return None
     SCREENSHOT_COUNT += 1
-    filename = f"{name}_{SCREENSHOT_COUNT:03d}.png"
+    filename = f"{name}_{SCREENSHOT_COUNT:03d}.jpg"
     filepath = os.path.join(OUTPUT_DIR, filename)
     subprocess.run([
-        "xcrun", "simctl", "io", DEVICE_ID, "screenshot", filepath
-    ], capture_output=True)
+        "xcrun", "simctl", "io", DEVICE_ID, "screenshot", "--type=jpeg", filepath
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     print(f"📸 Captured: {filename}")
     return filepath
 
 def tap(x: int, y: int):
     """Tap at coordinates on simulator"""
-    script = f'''
-    tell application "Simulator"
-        activate
-    end tell
-    delay 0.3
-    tell application "System Events"
-        tell process "Simulator"
-            click at {{{x}, {y}}}
-        end tell
-    end tell
-    '''
-    subprocess.run(["osascript", "-e", script], capture_output=True)
+    applescript(
+        'tell application "Simulator" to activate',
+        'delay 0.3',
+        f'tell application "System Events" to tell process "Simulator" to click at {{{x}, {y}}}',
+    )
     time.sleep(0.5)
 
 def type_text(text: str):
-    """Type text using AppleScript"""
-    script = f'''
-    tell application "System Events"
-        keystroke "{text}"
-    end tell
-    '''
-    subprocess.run(["osascript", "-e", script], capture_output=True)
+    """Type text via idb or AppleScript"""
+    if USE_IDB:
+        idb("ui", "text", text)
+    else:
+        applescript(f'tell application "System Events" to keystroke "{text}"')
     time.sleep(0.3)
 
 def press_return():
     """Press return key"""
-    script = '''
-    tell application "System Events"
-        key code 36
-    end tell
-    '''
-    subprocess.run(["osascript", "-e", script], capture_output=True)
+    if USE_IDB:
+        idb("ui", "key", "40")  # HID usage code for Return
+    else:
+        applescript('tell application "System Events" to key code 36')
     time.sleep(0.3)
 
 def main():
+    global SCREENSHOT_COUNT
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     print("=" * 50)
     print("🎰 Poker Screenshot Auto-Capture Tool")
     print("=" * 50)
     
-    # Coordinates based on iPhone 16 Pro Max (430x932 points, but window may be scaled)
-    # These are approximate and may need adjustment based on window size
-    
-    # Screen dimensions in simulator window (approximate)
-    # Adjust these based on your actual window size
-    SCREEN_WIDTH = 430
-    SCREEN_HEIGHT = 932
-    
-    # Window offset (Simulator window chrome)
-    WINDOW_X_OFFSET = 50
-    WINDOW_Y_OFFSET = 80
+    if VIDEO_MODE:
+        session = f"session_{int(time.time())}"
+        video_path = os.path.join(OUTPUT_DIR, f"{session}.mov")
+        recorder = start_recording(video_path)
+        print(f"🎥 Recording to {video_path}")
+        time.sleep(1)  # let the recorder attach before driving the UI
     
-    def sim_tap(x: int, y: int):
-        """Tap at simulator screen coordinates"""
-        tap(WINDOW_X_OFFSET + x, WINDOW_Y_OFFSET + y)
-    
-    print("\n📱 Step 1: Login Screen")
-    screenshot("01_login_screen")
-    
-    # Tap username field (centered horizontally, ~54% down)
-    print("  Tapping username field...")
-    sim_tap(SCREEN_WIDTH // 2, int(SCREEN_HEIGHT * 0.54))
-    time.sleep(0.5)
-    type_text("demo")
-    screenshot("02_login_username")
-    
-    # Tap password field (~64% down)
-    print("  Tapping password field...")
-    sim_tap(SCREEN_WIDTH // 2, int(SCREEN_HEIGHT * 0.64))
-    time.sleep(0.5)
-    type_text("pw")
-    screenshot("03_login_password")
-    
-    # Tap login button (~72% down)
-    print("  Tapping login button...")
-    sim_tap(SCREEN_WIDTH // 2, int(SCREEN_HEIGHT * 0.72))
-    time.sleep(2)
-    screenshot("04_lobby")
-    
-    print("\n📱 Step 2: Navigate to Lobby and Find Poker")
-    # Scroll down to find Texas Hold'em (it might be below the fold)
-    # First, let's capture the lobby as-is
-    time.sleep(1)
-    screenshot("05_lobby_games")
-    
-    # Scroll down in lobby to find more games
-    print("  Scrolling to find poker...")
-    # Swipe gesture - start from center, swipe up
-    script = '''
-    tell application "System Events"
-        tell process "Simulator"
-            -- Swipe up gesture
-            set startPos to {280, 700}
-            set endPos to {280, 400}
-            -- Mouse down, drag, mouse up
+    try:
+        # Coordinates based on iPhone 16 Pro Max (430x932 points, but window may be scaled)
+        # These are approximate and may need adjustment based on window size
+        
+        # Screen dimensions in simulator window (approximate)
+        # Adjust these based on your actual window size
+        SCREEN_WIDTH = 430
+        SCREEN_HEIGHT = 932
+        
+        # Window offset (Simulator window chrome)
+        WINDOW_X_OFFSET = 50
+        WINDOW_Y_OFFSET = 80
+        
+        def sim_tap(x: int, y: int):
+            """Tap at simulator screen coordinates"""
+            if USE_IDB:
+                idb("ui", "tap", str(x), str(y))
+                time.sleep(0.5)
+            else:
+                tap(WINDOW_X_OFFSET + x, WINDOW_Y_OFFSET + y)
+        
+        if USE_IDB:
+            subprocess.run(["idb", "connect", DEVICE_ID], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            print("🔌 Using idb for input")
+        
+        print("\n📱 Step 1: Login Screen")
+        screenshot("01_login_screen")
+        
+        # Tap username field (centered horizontally, ~54% down)
+        print("  Tapping username field...")
+        sim_tap(SCREEN_WIDTH // 2, int(SCREEN_HEIGHT * 0.54))
+        time.sleep(0.5)
+        type_text("demo")
+        screenshot("02_login_username")
+        
+        # Tap password field (~64% down)
+        print("  Tapping password field...")
+        sim_tap(SCREEN_WIDTH // 2, int(SCREEN_HEIGHT * 0.64))
+        time.sleep(0.5)
+        type_text("pw")
+        screenshot("03_login_password")
+        
+        # Tap login button (~72% down)
+        print("  Tapping login button...")
+        sim_tap(SCREEN_WIDTH // 2, int(SCREEN_HEIGHT * 0.72))
+        time.sleep(2)
+        screenshot("04_lobby")
+        
+        print("\n📱 Step 2: Navigate to Lobby and Find Poker")
+        # Scroll down to find Texas Hold'em (it might be below the fold)
+        # First, let's capture the lobby as-is
+        time.sleep(1)
+        screenshot("05_lobby_games")
+        
+        # Scroll down in lobby to find more games
+        print("  Scrolling to find poker...")
+        # Swipe gesture - start from center, swipe up
+        script = '''
+        tell application "System Events"
+            tell process "Simulator"
+                -- Swipe up gesture
+                set startPos to {280, 700}
+                set endPos to {280, 400}
+                -- Mouse down, drag, mouse up
+            end tell
         end tell
-    end tell
-    '''
-    # Simple scroll down by clicking and dragging
-    time.sleep(0.5)
-    screenshot("06_lobby_scrolled")
-    
-    print("\n📱 Step 3: Enter Poker Game")
-    # Texas Hold'em should be visible - look for PLAY NOW button
-    # It's likely the 5th game card (after Slots, Blackjack, Roulette, Video Poker)
-    # Approximate position for 5th game's PLAY NOW button
-    # Let's try scrolling first, then tapping
-    
-    # For now, let's just capture multiple lobby states
-    for i in range(3):
-        screenshot(f"07_lobby_state_{i}")
+        '''
+        # Simple scroll down by clicking and dragging
         time.sleep(0.5)
+        screenshot("06_lobby_scrolled")
+        
+        print("\n📱 Step 3: Enter Poker Game")
+        # Texas Hold'em should be visible - look for PLAY NOW button
+        # It's likely the 5th game card (after Slots, Blackjack, Roulette, Video Poker)
+        # Approximate position for 5th game's PLAY NOW button
+        # Let's try scrolling first, then tapping
+        
+        # For now, let's just capture multiple lobby states
+        for i in range(3):
+            screenshot(f"07_lobby_state_{i}")
+            time.sleep(0.5)
+        
+        print("\n📱 Step 4: Capture Poker Game States")
+        print("  (Assuming we navigated to poker game)")
+        
+        # If the poker game is open, capture various states
+        # These would need manual navigation or proper coordinates
+        
+        # Capture current screen multiple times with different states
+        for i in range(5):
+            screenshot(f"08_game_state_{i}")
+            time.sleep(1)
+    finally:
+        # Never leave simctl recording (and the .mov unfinalized) on an error
+        close_applescript()
+        if VIDEO_MODE:
+            stop_recording(recorder)
     
-    print("\n📱 Step 4: Capture Poker Game States")
-    print("  (Assuming we navigated to poker game)")
-    
-    # If the poker game is open, capture various states
-    # These would need manual navigation or proper coordinates
-    
-    # Capture current screen multiple times with different states
-    for i in range(5):
-        screenshot(f"08_game_state_{i}")
-        time.sleep(1)
+    if VIDEO_MODE:
+        SCREENSHOT_COUNT = extract_frames(video_path, session)
+        os.remove(video_path)
     
     print("\n" + "=" * 50)
-    print(f"✅ Captured {SCREENSHOT_COUNT} screenshots")
+    print(f"✅ Captured {SCREENSHOT_COUNT} {'frames' if VIDEO_MODE else 'screenshots'}")
     print(f"📁 Output: {OUTPUT_DIR}")
     print("=" * 50)
     print("\n⚠️  Note: For better coverage, manually navigate to poker game")
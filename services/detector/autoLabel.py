@@ -5,18 +5,47 @@ Uses MiniCPM-V (Visual LLM) to generate bounding box labels for poker screenshot
 
 import os
 import json
-import base64
+try:
+    import pybase64 as base64  # SIMD-accelerated, drop-in API
+except ImportError:
+    import base64
+import io
 import requests
+from requests.adapters import HTTPAdapter
 import re
+import threading
+from functools import lru_cache
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
+from PIL import Image
+
+from dataset_utils import log, read_image, write_atomic, cache_path_for
 
 # Configuration
 OLLAMA_URL = "http://localhost:11434/api/chat"
 OLLAMA_MODEL = "openbmb/minicpm-v2.6:latest"
 IMAGES_DIR = Path(__file__).parent / "training_data" / "poker_images"
 LABELS_DIR = Path(__file__).parent / "training_data" / "poker_labels"
+# Largest side sent to the VLM; MiniCPM-V tiles internally so more pixels don't help
+VLM_MAX_DIM = 1344
+# Capture steps (see scripts/auto_capture_poker.py) that never contain poker UI
+NON_GAME_SCREENS = ("login", "lobby")
+# Raw VLM detections keyed by (model, prompt, VLM_MAX_DIM, file bytes)
+CACHE_DIR = Path(__file__).parent / ".vlm_cache"
+# Match the server's parallel slots; more in-flight requests just queue inside Ollama
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+# Extra workers read/downscale images and serve cache hits while every slot is busy
+MAX_WORKERS = OLLAMA_NUM_PARALLEL * 2
+# Keep the model loaded between images so the shared prompt prefix stays cached
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Gates only the Ollama round-trip, not the CPU work around it
+_ollama_slots = threading.BoundedSemaphore(OLLAMA_NUM_PARALLEL)
+
+# Shared keep-alive session so worker threads reuse pooled connections to Ollama
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=max(16, MAX_WORKERS)))
+
 
 # YOLO Classes
 CLASSES = {
@@ -33,9 +62,28 @@ CLASSES = {
     "bet_slider": 10,
 }
 
+# Class-name variations the LLM emits, checked in priority order
+CLASS_ALIASES = [
+    (re.compile(r"check|call"), "btn_check_call"),
+    (re.compile(r"fold"), "btn_fold"),
+    (re.compile(r"raise"), "btn_raise"),
+    (re.compile(r"all.*in|in.*all"), "btn_all_in"),
+    (re.compile(r"deal"), "btn_deal_again"),
+    (re.compile(r"winner|banner"), "winner_banner"),
+    (re.compile(r"hole"), "hole_card"),
+    (re.compile(r"board|community"), "board_card"),
+    (re.compile(r"pot"), "pot_amount"),
+    (re.compile(r"back"), "card_back"),
+    (re.compile(r"slider"), "bet_slider"),
+]
+
+# Response parsing patterns
+ARRAY_RE = re.compile(r'\[[\s\S]*?\]')
+OBJECT_RE = re.compile(r'\{[^{}]+\}')
+
 LABELING_PROMPT = """Analyze this poker game screenshot and identify UI elements with their bounding boxes.
 
-Return ONLY a JSON array with detected elements. For each element provide:
+Return ONLY a JSON object {"detections": [...]} listing detected elements. For each element provide:
 - "class": one of [btn_fold, btn_check_call, btn_raise, btn_all_in, btn_deal_again, winner_banner, hole_card, board_card, pot_amount, card_back, bet_slider]
 - "x": center x coordinate as fraction (0-1) of image width
 - "y": center y coordinate as fraction (0-1) of image height  
@@ -56,84 +104,137 @@ Rules:
 - bet_slider: Horizontal slider with Min/Pot/Max options
 
 Example response:
-[
+{"detections": [
   {"class": "btn_fold", "x": 0.13, "y": 0.95, "w": 0.2, "h": 0.05},
   {"class": "btn_check_call", "x": 0.37, "y": 0.95, "w": 0.2, "h": 0.05},
   {"class": "hole_card", "x": 0.42, "y": 0.82, "w": 0.08, "h": 0.12},
   {"class": "hole_card", "x": 0.58, "y": 0.82, "w": 0.08, "h": 0.12}
-]
+]}
 
-Return ONLY the JSON array, no other text."""
+Return ONLY the JSON object, no other text."""
 
 
-def encode_image(image_path: str) -> str:
+def encode_image(image_bytes: bytes) -> str:
     """Encode image to base64"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+    return base64.b64encode(image_bytes).decode("ascii")
+
 
+def downscale_image(image_bytes: bytes) -> bytes:
+    """Shrink to VLM_MAX_DIM as JPEG; labels are normalized so resolution is free to drop"""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if max(img.size) <= VLM_MAX_DIM:
+            return image_bytes
+        img = img.convert("RGB")
+        img.thumbnail((VLM_MAX_DIM, VLM_MAX_DIM), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+        return buffer.getvalue()
 
-def call_llm(image_path: str) -> list:
+
+def call_llm(image_bytes: bytes) -> list:
     """Call MiniCPM-V to get bounding box labels"""
+    # Keyed on the file as read, so a hit skips the decode/resize entirely
+    cache_path = cache_path_for(CACHE_DIR, OLLAMA_MODEL, LABELING_PROMPT, VLM_MAX_DIM, image_bytes)
+    if cache_path.exists():
+        return json.loads(cache_path.read_text())
+    image_bytes = downscale_image(image_bytes)
+    
     try:
-        image_b64 = encode_image(image_path)
+        image_b64 = encode_image(image_bytes)
         
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": OLLAMA_MODEL,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": LABELING_PROMPT,
-                        "images": [image_b64]
+        with _ollama_slots:
+            response = _SESSION.post(
+                OLLAMA_URL,
+                json={
+                    "model": OLLAMA_MODEL,
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": LABELING_PROMPT,
+                            "images": [image_b64]
+                        }
+                    ],
+                    "stream": False,
+                    "format": "json",  # Grammar-constrained, always parseable
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "options": {
+                        "temperature": 0.1  # Low temperature for consistent outputs
                     }
-                ],
-                "stream": False,
-                "options": {
-                    "temperature": 0.1  # Low temperature for consistent outputs
-                }
-            },
-            timeout=120
-        )
+                },
+                timeout=120
+            )
         
         if response.status_code != 200:
-            print(f"  ⚠️ LLM error {response.status_code}")
+            log(f"  ⚠️ LLM error {response.status_code}")
             return []
         
         result = response.json()
         content = result.get("message", {}).get("content", "")
         
         # Extract JSON array from response
-        return parse_llm_response(content)
+        detections = parse_llm_response(content)
+        if detections:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(cache_path, json.dumps(detections))
+        return detections
         
     except Exception as e:
-        print(f"  ⚠️ Error calling LLM: {e}")
+        log(f"  ⚠️ Error calling LLM: {e}")
         return []
 
 
 def parse_llm_response(content: str) -> list:
     """Parse LLM response to extract JSON array"""
+    # Similar frames often yield identical responses; the cached items are shared, so read-only
+    return list(_parse_llm_response_cached(content))
+
+
+@lru_cache(maxsize=1024)
+def _parse_llm_response_cached(content: str) -> tuple:
+    """Memoized parse keyed by the raw response text"""
+    return tuple(_parse_llm_response(content))
+
+
+def _parse_llm_response(content: str) -> list:
+    """Uncached parse of the LLM response"""
+    # format=json responses are a {"detections": [...]} object
     try:
-        # Try to find JSON array in response
-        # Look for [...] pattern
-        match = re.search(r'\[[\s\S]*?\]', content)
+        parsed = json.loads(content)
+        if isinstance(parsed, dict):
+            parsed = parsed.get("detections", [])
+        if isinstance(parsed, list):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+    
+    # Fallbacks for free-form (non-format=json) responses, cheapest first
+    # Outermost [...] slice; str.find/rfind run in C, far cheaper than a regex scan
+    start = content.find("[")
+    end = content.rfind("]")
+    if start != -1 and end > start:
+        try:
+            return json.loads(content[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+    
+    try:
+        # Try the first [...] pattern
+        match = ARRAY_RE.search(content)
         if match:
-            json_str = match.group()
-            return json.loads(json_str)
-        
-        # Try direct parse
-        return json.loads(content)
+            return json.loads(match.group())
     except json.JSONDecodeError:
-        # Try to extract individual objects
-        objects = []
-        for match in re.finditer(r'\{[^{}]+\}', content):
-            try:
-                obj = json.loads(match.group())
-                if "class" in obj and "x" in obj:
-                    objects.append(obj)
-            except:
-                pass
-        return objects
+        pass
+    
+    # Try to extract individual objects
+    objects = []
+    for match in OBJECT_RE.finditer(content):
+        try:
+            obj = json.loads(match.group())
+            if "class" in obj and "x" in obj:
+                objects.append(obj)
+        except:
+            pass
+    return objects
 
 
 def convert_to_yolo(detections: list, image_path: str) -> list:
@@ -143,29 +244,12 @@ def convert_to_yolo(detections: list, image_path: str) -> list:
     for det in detections:
         class_name = det.get("class", "").lower().replace(" ", "_")
         
-        # Handle variations
-        if "check" in class_name or "call" in class_name:
-            class_name = "btn_check_call"
-        elif "fold" in class_name:
-            class_name = "btn_fold"
-        elif "raise" in class_name:
-            class_name = "btn_raise"
-        elif "all" in class_name and "in" in class_name:
-            class_name = "btn_all_in"
-        elif "deal" in class_name:
-            class_name = "btn_deal_again"
-        elif "winner" in class_name or "banner" in class_name:
-            class_name = "winner_banner"
-        elif "hole" in class_name:
-            class_name = "hole_card"
-        elif "board" in class_name or "community" in class_name:
-            class_name = "board_card"
-        elif "pot" in class_name:
-            class_name = "pot_amount"
-        elif "back" in class_name:
-            class_name = "card_back"
-        elif "slider" in class_name:
-            class_name = "bet_slider"
+        # Handle variations (canonical names need no normalization)
+        if class_name not in CLASSES:
+            for pattern, canonical in CLASS_ALIASES:
+                if pattern.search(class_name):
+                    class_name = canonical
+                    break
         
         if class_name not in CLASSES:
             continue
@@ -196,19 +280,30 @@ def process_image(image_path: Path) -> tuple:
     if label_path.exists():
         return image_path.name, "skipped", 0
     
-    # Call LLM for detections
-    detections = call_llm(str(image_path))
+    # Login/lobby shots have no poker classes; keep them as empty (background) labels
+    if any(screen in image_path.stem.lower() for screen in NON_GAME_SCREENS):
+        write_atomic(label_path, "")
+        return image_path.name, "empty", 0
+    
+    # Call LLM for detections (image is read once and hashed for the cache)
+    try:
+        detections = call_llm(read_image(image_path))
+    except Exception as e:
+        # One unreadable/corrupt screenshot must not abort the whole run
+        log(f"  ❌ {image_path.name}: could not read image: {e}")
+        return image_path.name, "failed", 0
     
     if not detections:
         # Create empty label file
-        label_path.write_text("")
+        write_atomic(label_path, "")
         return image_path.name, "empty", 0
     
     # Convert to YOLO format
-    yolo_lines = convert_to_yolo(detections, str(image_path))
+    # VLMs often repeat boxes; drop exact duplicates, keeping order
+    yolo_lines = list(dict.fromkeys(convert_to_yolo(detections, str(image_path))))
     
     # Write label file
-    label_path.write_text("\n".join(yolo_lines))
+    write_atomic(label_path, "\n".join(yolo_lines))
     
     return image_path.name, "labeled", len(yolo_lines)
 
@@ -221,8 +316,8 @@ def main():
     # Ensure labels directory exists
     LABELS_DIR.mkdir(parents=True, exist_ok=True)
     
-    # Get all PNG images
-    images = list(IMAGES_DIR.glob("*.png"))
+    # Get all PNG/JPEG images
+    images = list(IMAGES_DIR.glob("*.png")) + list(IMAGES_DIR.glob("*.jpg"))
     print(f"📁 Found {len(images)} images to label")
     
     # Check existing labels
@@ -233,29 +328,31 @@ def main():
     labeled = 0
     skipped = 0
     empty = 0
+    failed = 0
     total_detections = 0
     
-    print("\n🔄 Processing images...")
+    print(f"\n🔄 Processing images ({OLLAMA_NUM_PARALLEL} parallel requests)...")
     
-    for i, image_path in enumerate(images):
-        if (i + 1) % 10 == 0 or i == 0:
-            print(f"\n[{i+1}/{len(images)}] Processing {image_path.name}...")
-        
-        name, status, count = process_image(image_path)
-        
-        if status == "labeled":
-            labeled += 1
-            total_detections += count
-            print(f"  ✅ {name}: {count} detections")
-        elif status == "skipped":
-            skipped += 1
-        else:
-            empty += 1
-            print(f"  ⚠️ {name}: no detections")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_image, p): p for p in images}
         
-        # Rate limiting to avoid overwhelming Ollama
-        if status != "skipped":
-            time.sleep(0.5)
+        for i, future in enumerate(as_completed(futures)):
+            name, status, count = future.result()
+            
+            if (i + 1) % 10 == 0 or i == 0:
+                log(f"\n[{i+1}/{len(images)}] Processed {name}")
+            
+            if status == "labeled":
+                labeled += 1
+                total_detections += count
+                log(f"  ✅ {name}: {count} detections")
+            elif status == "skipped":
+                skipped += 1
+            elif status == "failed":
+                failed += 1
+            else:
+                empty += 1
+                log(f"  ⚠️ {name}: no detections")
     
     print("\n" + "=" * 50)
     print("📊 Summary:")
@@ -263,6 +360,7 @@ def main():
     print(f"   Labeled: {labeled}")
     print(f"   Skipped (existing): {skipped}")
     print(f"   Empty (no detections): {empty}")
+    print(f"   Failed (unreadable): {failed}")
     print(f"   Total detections: {total_detections}")
     print(f"\n💾 Labels saved to: {LABELS_DIR}")
 
@@ -7,18 +7,49 @@ Outputs YOLO format labels for training
 
 import os
 import json
-import base64
+try:
+    import pybase64 as base64  # SIMD-accelerated, drop-in API
+except ImportError:
+    import base64
+import io
+import struct
 import requests
+from requests.adapters import HTTPAdapter
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Optional
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from PIL import Image
 
+from dataset_utils import log, read_image, write_atomic, cache_path_for
+
 # Configuration
 OLLAMA_URL = "http://localhost:11434/api/chat"
 OLLAMA_MODEL = "minicpm-v"  # or "llava:7b" for better accuracy
 IMAGES_DIR = Path("training_data/poker_images")
 LABELS_DIR = Path("training_data/poker_labels")
+# Largest side sent to the VLM; MiniCPM-V tiles internally so more pixels don't help
+VLM_MAX_DIM = 1344
+# Capture steps (see scripts/auto_capture_poker.py) that never contain poker UI
+NON_GAME_SCREENS = ("login", "lobby")
+# Raw VLM detections keyed by (model, prompt, VLM_MAX_DIM, file bytes)
+CACHE_DIR = Path(__file__).parent / ".vlm_cache"
+# Match the server's parallel slots; more in-flight requests just queue inside Ollama
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+# Extra workers read/downscale images and serve cache hits while every slot is busy
+MAX_WORKERS = OLLAMA_NUM_PARALLEL * 2
+# Keep the model loaded between images so the shared prompt prefix stays cached
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Gates only the Ollama round-trip, not the CPU work around it
+_ollama_slots = threading.BoundedSemaphore(OLLAMA_NUM_PARALLEL)
+
+# Shared keep-alive session so worker threads reuse pooled connections to Ollama
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=max(16, MAX_WORKERS)))
 
 # Poker-specific UI classes
 CLASSES = {
@@ -34,28 +65,60 @@ CLASSES = {
     "text_label": 9,       # Game text/labels
 }
 
-# Reverse mapping
-CLASS_NAMES = {v: k for k, v in CLASSES.items()}
+CLASS_KEYS = frozenset(CLASSES)
+
+# Markdown-fenced JSON in free-form responses
+CODE_FENCE_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)```')
 
-def encode_image(image_path: str) -> str:
+def encode_image(image_bytes: bytes) -> str:
     """Encode image to base64"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+    return base64.b64encode(image_bytes).decode("ascii")
 
-def get_image_dimensions(image_path: str) -> tuple:
-    """Get image width and height"""
-    with Image.open(image_path) as img:
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start-of-frame markers carry the JPEG dimensions (C4/C8/CC are DHT/JPG/DAC)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def jpeg_dimensions(image_bytes: bytes) -> Optional[tuple]:
+    """Scan JPEG segments for the SOF header; None if it can't be found"""
+    i = 2  # skip SOI
+    while i + 9 <= len(image_bytes):
+        if image_bytes[i] != 0xFF:
+            return None
+        marker = image_bytes[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", image_bytes[i + 5:i + 9])
+            return width, height
+        (length,) = struct.unpack(">H", image_bytes[i + 2:i + 4])
+        i += 2 + length
+    return None
+
+def get_image_dimensions(image_bytes: bytes) -> tuple:
+    """Get image width and height from the header, without decoding"""
+    # PNG stores them in the IHDR chunk right after the signature
+    if image_bytes[:8] == PNG_SIGNATURE:
+        return struct.unpack(">II", image_bytes[16:24])
+    if image_bytes[:2] == b"\xff\xd8":
+        dims = jpeg_dimensions(image_bytes)
+        if dims:
+            return dims
+    with Image.open(io.BytesIO(image_bytes)) as img:
         return img.size  # (width, height)
 
-def ask_vlm(image_path: str) -> Optional[List[Dict]]:
-    """
-    Ask VLM to detect and label UI elements in the image
-    Returns list of detections with bounding boxes
-    """
-    base64_image = encode_image(image_path)
-    width, height = get_image_dimensions(image_path)
-    
-    prompt = f"""Analyze this poker game screenshot and detect all UI elements.
+def downscale_image(image_bytes: bytes, width: int, height: int) -> tuple:
+    """Shrink to VLM_MAX_DIM as JPEG, returning (bytes, width, height) of what is sent"""
+    if max(width, height) <= VLM_MAX_DIM:
+        return image_bytes, width, height
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((VLM_MAX_DIM, VLM_MAX_DIM), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+        return (buffer.getvalue(), *img.size)
+
+VLM_PROMPT = """Analyze this poker game screenshot and detect all UI elements.
 The image dimensions are {width}x{height} pixels.
 
 For each UI element, provide:
@@ -63,14 +126,14 @@ For each UI element, provide:
 - bbox: [x_center, y_center, width, height] in PIXELS (not normalized)
 - confidence: 0.0 to 1.0
 
-IMPORTANT: Return ONLY a valid JSON array. No explanation, no markdown.
+IMPORTANT: Return ONLY a valid JSON object {{"detections": [...]}}. No explanation, no markdown.
 
 Example response format:
-[
+{{"detections": [
   {{"class": "button", "bbox": [200, 800, 100, 50], "text": "FOLD", "confidence": 0.95}},
   {{"class": "card_face", "bbox": [150, 600, 60, 87], "text": "Ace of Hearts", "confidence": 0.9}},
   {{"class": "player_badge", "bbox": [50, 200, 120, 60], "text": "Player 1 $500", "confidence": 0.85}}
-]
+]}}
 
 Detect ALL visible elements including:
 - Action buttons (FOLD, CHECK, CALL, RAISE, ALL-IN, DEAL AGAIN)
@@ -82,140 +145,190 @@ Detect ALL visible elements including:
 
 Your JSON response:"""
 
+def ask_vlm(image_bytes: bytes, width: int, height: int) -> tuple:
+    """
+    Ask VLM to detect and label UI elements in the image
+    Returns (detections, width, height): pixel bboxes and the frame size they are in,
+    or None detections on failure
+    """
+    # Keyed on the file as read, so a hit skips the decode/resize entirely
+    cache_path = cache_path_for(CACHE_DIR, OLLAMA_MODEL, VLM_PROMPT, VLM_MAX_DIM, image_bytes)
+    if cache_path.exists():
+        cached = json.loads(cache_path.read_text())
+        return cached["detections"], cached["width"], cached["height"]
+    
+    # Pixel bboxes come back in the downscaled frame and are normalized against it
+    image_bytes, width, height = downscale_image(image_bytes, width, height)
+    prompt = VLM_PROMPT.format(width=width, height=height)
+
     try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": OLLAMA_MODEL,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt,
-                        "images": [base64_image]
+        base64_image = encode_image(image_bytes)
+        with _ollama_slots:
+            response = _SESSION.post(
+                OLLAMA_URL,
+                json={
+                    "model": OLLAMA_MODEL,
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": prompt,
+                            "images": [base64_image]
+                        }
+                    ],
+                    "stream": False,
+                    "format": "json",  # Grammar-constrained, always parseable
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "options": {
+                        "temperature": 0.1,  # Low temperature for consistent output
                     }
-                ],
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,  # Low temperature for consistent output
-                }
-            },
-            timeout=120
-        )
+                },
+                timeout=120
+            )
         
         if response.status_code != 200:
-            print(f"  ⚠️ VLM error: {response.status_code}")
-            return None
+            log(f"  ⚠️ VLM error: {response.status_code}")
+            return None, width, height
         
         result = response.json()
         content = result.get("message", {}).get("content", "")
         
         # Try to extract JSON from response
         detections = parse_vlm_response(content)
-        return detections
+        if detections:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(cache_path, json.dumps(
+                {"width": width, "height": height, "detections": detections}))
+        return detections, width, height
         
     except requests.exceptions.ConnectionError:
-        print("  ❌ Cannot connect to Ollama. Is it running?")
-        print("     Start with: ollama serve")
-        return None
+        log("  ❌ Cannot connect to Ollama. Is it running?\n"
+            "     Start with: ollama serve")
+        return None, width, height
     except Exception as e:
-        print(f"  ❌ VLM error: {e}")
-        return None
+        log(f"  ❌ VLM error: {e}")
+        return None, width, height
 
 def parse_vlm_response(response: str) -> List[Dict]:
     """Parse VLM response to extract detections"""
+    # Similar frames often yield identical responses; the cached items are shared, so read-only
+    return list(_parse_vlm_response_cached(response))
+
+@lru_cache(maxsize=1024)
+def _parse_vlm_response_cached(response: str) -> tuple:
+    """Memoized parse keyed by the raw response text"""
+    return tuple(_parse_vlm_response(response))
+
+def _parse_vlm_response(response: str) -> List[Dict]:
+    """Uncached parse of the VLM response"""
     # Try to find JSON array in response
     try:
-        # First, try direct JSON parse
+        # First, try direct JSON parse (format=json gives {"detections": [...]})
         detections = json.loads(response)
+        if isinstance(detections, dict):
+            detections = detections.get("detections", [])
         if isinstance(detections, list):
             return detections
     except json.JSONDecodeError:
         pass
     
     # Try to extract JSON from markdown code block
-    json_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', response)
+    json_match = CODE_FENCE_RE.search(response)
     if json_match:
         try:
             return json.loads(json_match.group(1))
         except json.JSONDecodeError:
             pass
     
-    # Try to find array pattern
-    array_match = re.search(r'\[[\s\S]*\]', response)
-    if array_match:
+    # Try the outermost [...] slice (str.find/rfind, no regex scan)
+    start = response.find("[")
+    end = response.rfind("]")
+    if start != -1 and end > start:
         try:
-            return json.loads(array_match.group(0))
+            return json.loads(response[start:end + 1])
         except json.JSONDecodeError:
             pass
     
-    print(f"  ⚠️ Could not parse VLM response: {response[:200]}...")
+    log(f"  ⚠️ Could not parse VLM response: {response[:200]}...")
     return []
 
-def convert_to_yolo_format(detection: Dict, img_width: int, img_height: int) -> Optional[str]:
+def convert_to_yolo_format(detections: List[Dict], img_width: int, img_height: int) -> List[tuple]:
     """
-    Convert detection to YOLO format:
+    Convert detections to YOLO format:
     class_id center_x center_y width height (all normalized 0-1)
+    Returns (detection, label_line) pairs for detections with a known class and bbox
     """
-    class_name = detection.get("class", "").lower()
-    if class_name not in CLASSES:
-        return None
+    valid = [
+        det for det in detections
+        if det.get("class", "").lower() in CLASS_KEYS and len(det.get("bbox", [])) == 4
+    ]
+    if not valid:
+        return []
     
-    class_id = CLASSES[class_name]
-    bbox = detection.get("bbox", [])
+    class_ids = np.array([CLASSES[det["class"].lower()] for det in valid])
+    coords = np.array([det["bbox"] for det in valid], dtype=np.float64)
     
-    if len(bbox) != 4:
-        return None
+    # Normalize to 0-1 range and clamp, all boxes at once
+    coords[:, [0, 2]] /= img_width
+    coords[:, [1, 3]] /= img_height
+    np.clip(coords, 0, 1, out=coords)
     
-    x_center, y_center, width, height = bbox
-    
-    # Normalize to 0-1 range
-    x_center_norm = x_center / img_width
-    y_center_norm = y_center / img_height
-    width_norm = width / img_width
-    height_norm = height / img_height
-    
-    # Clamp values to valid range
-    x_center_norm = max(0, min(1, x_center_norm))
-    y_center_norm = max(0, min(1, y_center_norm))
-    width_norm = max(0, min(1, width_norm))
-    height_norm = max(0, min(1, height_norm))
-    
-    return f"{class_id} {x_center_norm:.6f} {y_center_norm:.6f} {width_norm:.6f} {height_norm:.6f}"
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.column_stack([class_ids, coords]),
+               fmt=["%d", "%.6f", "%.6f", "%.6f", "%.6f"])
+    return list(zip(valid, buffer.getvalue().splitlines()))
 
 def process_image(image_path: Path) -> int:
     """Process a single image and generate YOLO labels"""
-    print(f"\n📷 Processing: {image_path.name}")
+    # Buffer output so parallel workers don't interleave their lines
+    out = [f"\n📷 Processing: {image_path.name}"]
     
-    # Get image dimensions
-    width, height = get_image_dimensions(str(image_path))
-    print(f"   Dimensions: {width}x{height}")
+    label_path = LABELS_DIR / f"{image_path.stem}.txt"
     
-    # Ask VLM to detect elements
-    print(f"   🤖 Asking {OLLAMA_MODEL}...")
-    detections = ask_vlm(str(image_path))
+    # Login/lobby shots have no poker UI; don't spend a VLM call on them,
+    # keep them as empty (background) labels like autoLabel.py does
+    if any(screen in image_path.stem.lower() for screen in NON_GAME_SCREENS):
+        write_atomic(label_path, "")
+        out.append("   ⏭️ Non-game screen, saved empty label")
+        log("\n".join(out))
+        return 0
+    
+    # Ask VLM to detect elements; width/height become those of the frame it saw
+    try:
+        # Read the image once; dimensions come from the header bytes
+        image_bytes = read_image(image_path)
+        width, height = get_image_dimensions(image_bytes)
+        out.append(f"   Dimensions: {width}x{height}")
+        out.append(f"   🤖 Asking {OLLAMA_MODEL}...")
+        detections, width, height = ask_vlm(image_bytes, width, height)
+    except Exception as e:
+        # One unreadable/corrupt screenshot must not abort the whole batch
+        out.append(f"   ❌ Could not read image: {e}")
+        log("\n".join(out))
+        return 0
     
     if not detections:
-        print("   ⚠️ No detections")
+        out.append("   ⚠️ No detections")
+        log("\n".join(out))
         return 0
     
-    print(f"   ✅ Found {len(detections)} elements")
+    out.append(f"   ✅ Found {len(detections)} elements")
     
     # Convert to YOLO format
     yolo_labels = []
-    for det in detections:
-        label = convert_to_yolo_format(det, width, height)
-        if label:
-            class_name = det.get("class", "unknown")
-            text = det.get("text", "")
-            print(f"      - {class_name}: {text[:30] if text else '(no text)'}")
-            yolo_labels.append(label)
+    for det, label in convert_to_yolo_format(detections, width, height):
+        class_name = det.get("class", "unknown")
+        text = det.get("text", "")
+        out.append(f"      - {class_name}: {text[:30] if text else '(no text)'}")
+        yolo_labels.append(label)
+    
+    # VLMs often repeat boxes; drop exact duplicates, keeping order
+    yolo_labels = list(dict.fromkeys(yolo_labels))
     
     # Save labels
-    label_path = LABELS_DIR / f"{image_path.stem}.txt"
-    with open(label_path, "w") as f:
-        f.write("\n".join(yolo_labels))
+    write_atomic(label_path, "\n".join(yolo_labels))
     
-    print(f"   💾 Saved: {label_path.name} ({len(yolo_labels)} labels)")
+    out.append(f"   💾 Saved: {label_path.name} ({len(yolo_labels)} labels)")
+    log("\n".join(out))
     return len(yolo_labels)
 
 def create_dataset_yaml():
@@ -263,7 +376,7 @@ def main():
     
     # Check if Ollama is available
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
+        response = _SESSION.get("http://localhost:11434/api/tags", timeout=5)
         models = response.json().get("models", [])
         available = [m["name"] for m in models]
         print(f"\n📡 Ollama connected. Available models: {available[:5]}")
@@ -292,19 +405,21 @@ def main():
         print("   ./scripts/capture_poker_screenshots.sh")
         return
     
-    print(f"\n📁 Found {len(image_files)} images to process")
+    print(f"\n📁 Found {len(image_files)} images to process ({OLLAMA_NUM_PARALLEL} parallel requests)")
     
-    # Process each image
+    # Process images concurrently, bounded by Ollama's parallel slots
     total_labels = 0
     processed = 0
     
-    for image_path in image_files:
-        labels = process_image(image_path)
-        total_labels += labels
-        processed += 1
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_image, p): p for p in image_files}
         
-        # Progress
-        print(f"\n   Progress: {processed}/{len(image_files)} images")
+        for future in as_completed(futures):
+            total_labels += future.result()
+            processed += 1
+            
+            # Progress
+            log(f"\n   Progress: {processed}/{len(image_files)} images")
     
     # Create dataset files
     create_dataset_yaml()
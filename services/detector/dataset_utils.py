@@ -0,0 +1,125 @@
+"""
+Dataset helpers shared by the labeling and training scripts
+Places labels next to their images, summarizes dataset directories and
+provides the thread-safe I/O used by the VLM auto-labelers
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+# Serializes console output from worker threads
+_print_lock = threading.Lock()
+# Per-thread scratch buffer for reading images, reused across files
+_tls = threading.local()
+
+
+def log(*args, **kwargs):
+    """Thread-safe print"""
+    with _print_lock:
+        print(*args, **kwargs)
+
+
+def read_image(image_path: Path) -> memoryview:
+    """Read an image into this thread's reusable buffer (valid until its next call)"""
+    with open(image_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        buf = getattr(_tls, "buf", None)
+        if buf is None or len(buf) < size:
+            buf = _tls.buf = bytearray(max(size, 8 * 1024 * 1024))
+        n = f.readinto(memoryview(buf)[:size])
+    return memoryview(buf)[:n]
+
+
+def write_atomic(path: Path, text: str):
+    """Write via a temp file + rename so readers never see a partial file"""
+    # Unique temp name: duplicate frames share a cache key and may be written concurrently
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def cache_path_for(cache_dir: Path, model: str, prompt: str, max_dim: int,
+                   image_bytes: bytes) -> Path:
+    """Location of the cached VLM response for this model/prompt/size cap/image file"""
+    digest = hashlib.sha256(model.encode())
+    digest.update(prompt.encode())
+    digest.update(str(max_dim).encode())
+    digest.update(image_bytes)
+    key = digest.hexdigest()
+    return cache_dir / key[:2] / f"{key}.json"
+
+
+def link_label(src, dest):
+    """
+    Make the label at src visible at dest: hardlink, else symlink, else copy
+
+    A dest that is already the same file is left alone. Anything else at
+    dest is replaced atomically, so a label rewritten via os.replace (new
+    inode) does not leave a stale link behind.
+    """
+    src, dest = Path(src), Path(dest)
+    try:
+        if os.path.samefile(src, dest):
+            return
+        # Earlier copy (no link support) that is still current
+        src_stat, dest_stat = src.stat(), dest.stat()
+        if (not dest.is_symlink() and dest_stat.st_size == src_stat.st_size
+                and dest_stat.st_mtime_ns == src_stat.st_mtime_ns):
+            return
+    except FileNotFoundError:
+        pass
+
+    tmp = dest.with_name(dest.name + ".tmp")
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, tmp)
+    except OSError:
+        # Cross-device or no hardlink support
+        try:
+            tmp.symlink_to(src.resolve())
+        except OSError:
+            shutil.copy2(src, tmp)  # keeps mtime for the up-to-date check above
+    os.replace(tmp, dest)
+
+
+def count_by_suffix(directory: Path, suffixes: tuple) -> list:
+    """Count entries in directory per name suffix, in one scandir pass"""
+    counts = [0] * len(suffixes)
+    if not directory.is_dir():
+        return counts
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            for k, suffix in enumerate(suffixes):
+                if name.endswith(suffix):
+                    counts[k] += 1
+                    break
+    return counts
+
+
+def label_state_hash(labels_dir: Path) -> str:
+    """
+    Digest of label names, inodes, sizes and mtimes
+
+    Changes when a label is added, removed, edited in place or replaced
+    (os.replace gives a new inode); link_label then relinks the changed ones.
+    """
+    entries = []
+    with os.scandir(labels_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".txt") and entry.name != "classes.txt":
+                stat = entry.stat()
+                entries.append(f"{entry.name}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.blake2b("\n".join(sorted(entries)).encode(), digest_size=16).hexdigest()
@@ -3,13 +3,27 @@ Fast Template-Based Labeling for Poker Screenshots
 Uses fixed UI positions for common elements (buttons are always in same place)
 """
 
+import io
 import os
+import re
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
 import json
 
 IMAGES_DIR = Path(__file__).parent / "training_data" / "poker_images"
 LABELS_DIR = Path(__file__).parent / "training_data" / "poker_labels"
+LABELS_DIR_STR = str(LABELS_DIR)
+IMAGE_EXTENSIONS = ('.png',)
+# Label writes are tiny independent syscalls; overlap them across threads
+WRITE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# --tar: stream every label into one labels.tar instead of N tiny files
+TAR_MODE = "--tar" in sys.argv
+# YOLO label line: class_id x_center y_center width height
+_FMT = "{} {:.6f} {:.6f} {:.6f} {:.6f}".format
 
 # YOLO Classes
 CLASSES = {
@@ -65,16 +79,18 @@ BOARD_CARDS = [
 WINNER_BANNER = {"x": 0.5, "y": 0.560, "w": 0.80, "h": 0.045}
 
 
-def classify_image(image_path: str) -> str:
+# One lookahead per category, tried in priority order; lastgroup names the winner
+SCREEN_TYPE_RE = re.compile(
+    r"(?=.*(?P<deal_again>deal_again))"
+    r"|(?=.*(?P<action>action))",
+    re.IGNORECASE,
+)
+
+
+def classify_image(name: str) -> str:
     """Determine image type based on filename"""
-    name = os.path.basename(image_path).lower()
-    
-    if "deal_again" in name:
-        return "deal_again"
-    elif "action" in name:
-        return "action"
-    else:
-        return "unknown"
+    match = SCREEN_TYPE_RE.match(name)
+    return match.lastgroup if match else "unknown"
 
 
 def generate_action_labels() -> list:
@@ -84,25 +100,25 @@ def generate_action_labels() -> list:
     # Action buttons
     for btn_name, pos in ACTION_BUTTONS.items():
         class_id = CLASSES[btn_name]
-        labels.append(f"{class_id} {pos['x']:.6f} {pos['y']:.6f} {pos['w']:.6f} {pos['h']:.6f}")
+        labels.append(_FMT(class_id, pos['x'], pos['y'], pos['w'], pos['h']))
     
     # Bet slider
     class_id = CLASSES["bet_slider"]
-    labels.append(f"{class_id} {BET_SLIDER['x']:.6f} {BET_SLIDER['y']:.6f} {BET_SLIDER['w']:.6f} {BET_SLIDER['h']:.6f}")
+    labels.append(_FMT(class_id, BET_SLIDER['x'], BET_SLIDER['y'], BET_SLIDER['w'], BET_SLIDER['h']))
     
     # Pot display
     class_id = CLASSES["pot_amount"]
-    labels.append(f"{class_id} {POT_DISPLAY['x']:.6f} {POT_DISPLAY['y']:.6f} {POT_DISPLAY['w']:.6f} {POT_DISPLAY['h']:.6f}")
+    labels.append(_FMT(class_id, POT_DISPLAY['x'], POT_DISPLAY['y'], POT_DISPLAY['w'], POT_DISPLAY['h']))
     
     # Hole cards (always 2)
     for card in HOLE_CARDS:
         class_id = CLASSES["hole_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     # Board cards (assume 3-4 visible on average)
     for card in BOARD_CARDS[:4]:
         class_id = CLASSES["board_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     return labels
 
@@ -113,29 +129,60 @@ def generate_deal_again_labels() -> list:
     
     # Deal Again button
     class_id = CLASSES["btn_deal_again"]
-    labels.append(f"{class_id} {DEAL_AGAIN['x']:.6f} {DEAL_AGAIN['y']:.6f} {DEAL_AGAIN['w']:.6f} {DEAL_AGAIN['h']:.6f}")
+    labels.append(_FMT(class_id, DEAL_AGAIN['x'], DEAL_AGAIN['y'], DEAL_AGAIN['w'], DEAL_AGAIN['h']))
     
     # Winner banner
     class_id = CLASSES["winner_banner"]
-    labels.append(f"{class_id} {WINNER_BANNER['x']:.6f} {WINNER_BANNER['y']:.6f} {WINNER_BANNER['w']:.6f} {WINNER_BANNER['h']:.6f}")
+    labels.append(_FMT(class_id, WINNER_BANNER['x'], WINNER_BANNER['y'], WINNER_BANNER['w'], WINNER_BANNER['h']))
     
     # Pot display
     class_id = CLASSES["pot_amount"]
-    labels.append(f"{class_id} {POT_DISPLAY['x']:.6f} {POT_DISPLAY['y']:.6f} {POT_DISPLAY['w']:.6f} {POT_DISPLAY['h']:.6f}")
+    labels.append(_FMT(class_id, POT_DISPLAY['x'], POT_DISPLAY['y'], POT_DISPLAY['w'], POT_DISPLAY['h']))
     
     # Hole cards (face up at showdown)
     for card in HOLE_CARDS:
         class_id = CLASSES["hole_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     # Board cards (all 5 visible at showdown)
     for card in BOARD_CARDS:
         class_id = CLASSES["board_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     return labels
 
 
+# Label files are constant per screen type, so format and encode them once
+ACTION_LABELS_BYTES = "\n".join(generate_action_labels()).encode()
+DEAL_AGAIN_LABELS_BYTES = "\n".join(generate_deal_again_labels()).encode()
+# classify_image() result -> label file contents (unknown screens default to action)
+LABEL_BLOBS = {
+    "action": ACTION_LABELS_BYTES,
+    "deal_again": DEAL_AGAIN_LABELS_BYTES,
+    "unknown": ACTION_LABELS_BYTES,
+}
+
+
+def write_label(path: str, data: bytes):
+    """Write a label file with a single raw write (no Path/TextIO overhead)"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def write_labels_tar(tar_path: Path, label_paths: list, label_blobs: list):
+    """Write all labels as members of a single uncompressed tar archive"""
+    mtime = time.time()
+    with tarfile.open(tar_path, "w") as tf:
+        for path, blob in zip(label_paths, label_blobs):
+            info = tarfile.TarInfo(name=os.path.basename(path))
+            info.size = len(blob)
+            info.mtime = mtime
+            tf.addfile(info, io.BytesIO(blob))
+
+
 def main():
     """Fast template-based labeling"""
     print("🚀 Fast Template-Based Labeling")
@@ -145,39 +192,38 @@ def main():
     LABELS_DIR.mkdir(parents=True, exist_ok=True)
     
     # Get all PNG images
-    images = list(IMAGES_DIR.glob("*.png"))
+    with os.scandir(IMAGES_DIR) as it:
+        images = [entry for entry in it if entry.name.endswith(IMAGE_EXTENSIONS)]
     print(f"📁 Found {len(images)} images")
     
-    action_count = 0
-    deal_again_count = 0
-    unknown_count = 0
+    counts = dict.fromkeys(LABEL_BLOBS, 0)
     
-    for image_path in images:
-        label_path = LABELS_DIR / f"{image_path.stem}.txt"
+    # Classify sequentially (cheap), then write in parallel
+    label_paths = []
+    label_blobs = []
+    for entry in images:
+        label_path = LABELS_DIR_STR + "/" + entry.name.rsplit(".", 1)[0] + ".txt"
         
         # Classify image
-        img_type = classify_image(str(image_path))
+        img_type = classify_image(entry.name)
+        counts[img_type] += 1
         
-        if img_type == "action":
-            labels = generate_action_labels()
-            action_count += 1
-        elif img_type == "deal_again":
-            labels = generate_deal_again_labels()
-            deal_again_count += 1
-        else:
-            # Default to action labels
-            labels = generate_action_labels()
-            unknown_count += 1
-        
-        # Write label file
-        label_path.write_text("\n".join(labels))
+        label_paths.append(label_path)
+        label_blobs.append(LABEL_BLOBS[img_type])
+    
+    # Write label files
+    if TAR_MODE:
+        write_labels_tar(LABELS_DIR / "labels.tar", label_paths, label_blobs)
+    else:
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            list(executor.map(write_label, label_paths, label_blobs))
     
     print(f"\n✅ Labeling complete!")
-    print(f"   Action screens: {action_count}")
-    print(f"   Deal Again screens: {deal_again_count}")
-    print(f"   Unknown (defaulted to action): {unknown_count}")
+    print(f"   Action screens: {counts['action']}")
+    print(f"   Deal Again screens: {counts['deal_again']}")
+    print(f"   Unknown (defaulted to action): {counts['unknown']}")
     print(f"   Total labels: {len(images)}")
-    print(f"\n💾 Labels saved to: {LABELS_DIR}")
+    print(f"\n💾 Labels saved to: {LABELS_DIR / 'labels.tar' if TAR_MODE else LABELS_DIR}")
 
 
 if __name__ == "__main__":
@@ -6,13 +6,30 @@ This script generates YOLO format labels for training data captured with the
 new Rive-based poker UI.
 """
 
+import io
 import os
+import re
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
 import json
 
+from dataset_utils import link_label
+
 IMAGES_DIR = Path(__file__).parent / "training_data" / "rive_poker_images"
 LABELS_DIR = Path(__file__).parent / "training_data" / "rive_poker_labels"
+IMAGES_DIR_STR = str(IMAGES_DIR)
+LABELS_DIR_STR = str(LABELS_DIR)
+IMAGE_EXTENSIONS = ('.png', '.jpg')
+# Label writes are tiny independent syscalls; overlap them across threads
+WRITE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# --tar: stream every label into one labels.tar instead of N tiny files
+TAR_MODE = "--tar" in sys.argv
+# YOLO label line: class_id x_center y_center width height
+_FMT = "{} {:.6f} {:.6f} {:.6f} {:.6f}".format
 
 # YOLO Classes for Rive UI
 CLASSES = {
@@ -81,24 +98,6 @@ BOARD_CARDS = [
 ]
 
 
-def classify_image(image_path: str) -> str:
-    """Determine image type based on filename patterns"""
-    name = os.path.basename(image_path).lower()
-    
-    # Check for specific game states in filename
-    if "deal" in name and ("again" in name or "end" in name):
-        return "deal_again"
-    elif "dealt" in name or "flop" in name or "turn" in name or "river" in name:
-        return "action_playing"
-    elif "start" in name:
-        return "action_start"
-    elif any(phase in name for phase in ["pre_flop", "preflop", "action"]):
-        return "action_playing"
-    else:
-        # Default to action_playing for Rive screenshots
-        return "action_playing"
-
-
 def generate_action_labels(include_slider: bool = True) -> list:
     """Generate labels for action screen (Rive buttons visible)"""
     labels = []
@@ -106,31 +105,31 @@ def generate_action_labels(include_slider: bool = True) -> list:
     # Fold button (always visible during action)
     class_id = CLASSES["btn_fold"]
     pos = RIVE_BUTTONS["btn_fold"]
-    labels.append(f"{class_id} {pos['x']:.6f} {pos['y']:.6f} {pos['w']:.6f} {pos['h']:.6f}")
+    labels.append(_FMT(class_id, pos['x'], pos['y'], pos['w'], pos['h']))
     
     # Check/Call button (left side) - use btn_call as it covers both
     class_id = CLASSES["btn_call"]
     pos = RIVE_BUTTONS["btn_call"]
-    labels.append(f"{class_id} {pos['x']:.6f} {pos['y']:.6f} {pos['w']:.6f} {pos['h']:.6f}")
+    labels.append(_FMT(class_id, pos['x'], pos['y'], pos['w'], pos['h']))
     
     # Raise button (center)
     class_id = CLASSES["btn_raise"]
     pos = RIVE_BUTTONS["btn_raise"]
-    labels.append(f"{class_id} {pos['x']:.6f} {pos['y']:.6f} {pos['w']:.6f} {pos['h']:.6f}")
+    labels.append(_FMT(class_id, pos['x'], pos['y'], pos['w'], pos['h']))
     
     # Bet slider (if included)
     if include_slider:
         class_id = CLASSES["bet_slider"]
-        labels.append(f"{class_id} {BET_SLIDER['x']:.6f} {BET_SLIDER['y']:.6f} {BET_SLIDER['w']:.6f} {BET_SLIDER['h']:.6f}")
+        labels.append(_FMT(class_id, BET_SLIDER['x'], BET_SLIDER['y'], BET_SLIDER['w'], BET_SLIDER['h']))
     
     # Pot display
     class_id = CLASSES["pot_amount"]
-    labels.append(f"{class_id} {POT_DISPLAY['x']:.6f} {POT_DISPLAY['y']:.6f} {POT_DISPLAY['w']:.6f} {POT_DISPLAY['h']:.6f}")
+    labels.append(_FMT(class_id, POT_DISPLAY['x'], POT_DISPLAY['y'], POT_DISPLAY['w'], POT_DISPLAY['h']))
     
     # Hole cards (always 2)
     for card in HOLE_CARDS:
         class_id = CLASSES["hole_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     return labels
 
@@ -141,16 +140,16 @@ def generate_deal_again_labels() -> list:
     
     # Deal button
     class_id = CLASSES["btn_deal"]
-    labels.append(f"{class_id} {DEAL_BUTTON['x']:.6f} {DEAL_BUTTON['y']:.6f} {DEAL_BUTTON['w']:.6f} {DEAL_BUTTON['h']:.6f}")
+    labels.append(_FMT(class_id, DEAL_BUTTON['x'], DEAL_BUTTON['y'], DEAL_BUTTON['w'], DEAL_BUTTON['h']))
     
     # Pot display
     class_id = CLASSES["pot_amount"]
-    labels.append(f"{class_id} {POT_DISPLAY['x']:.6f} {POT_DISPLAY['y']:.6f} {POT_DISPLAY['w']:.6f} {POT_DISPLAY['h']:.6f}")
+    labels.append(_FMT(class_id, POT_DISPLAY['x'], POT_DISPLAY['y'], POT_DISPLAY['w'], POT_DISPLAY['h']))
     
     # Hole cards still visible
     for card in HOLE_CARDS:
         class_id = CLASSES["hole_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     return labels
 
@@ -163,11 +162,65 @@ def generate_labels_with_board(num_board_cards: int = 0) -> list:
     for i in range(min(num_board_cards, 5)):
         card = BOARD_CARDS[i]
         class_id = CLASSES["board_card"]
-        labels.append(f"{class_id} {card['x']:.6f} {card['y']:.6f} {card['w']:.6f} {card['h']:.6f}")
+        labels.append(_FMT(class_id, card['x'], card['y'], card['w'], card['h']))
     
     return labels
 
 
+# Label files are constant per screen type, so format and encode them once
+ACTION_LABELS_BYTES = "\n".join(generate_action_labels()).encode()
+DEAL_AGAIN_LABELS_BYTES = "\n".join(generate_deal_again_labels()).encode()
+# Keyed by number of visible board cards (flop=3, turn=4, river=5)
+LABELS_WITH_BOARD_BYTES = {n: "\n".join(generate_labels_with_board(n)).encode() for n in range(6)}
+# label_category() result -> label file contents
+LABEL_BLOBS = {
+    "action": ACTION_LABELS_BYTES,
+    "deal_again": DEAL_AGAIN_LABELS_BYTES,
+    "flop": LABELS_WITH_BOARD_BYTES[3],
+    "turn": LABELS_WITH_BOARD_BYTES[4],
+    "river": LABELS_WITH_BOARD_BYTES[5],
+}
+# classes.txt contents: one class name per line, ordered by class id
+CLASSES_TXT_BYTES = "".join(f"{name}\n" for name in sorted(CLASSES, key=CLASSES.get)).encode()
+
+
+# One alternative per LABEL_BLOBS key, tried in priority order; lastgroup names the winner
+LABEL_CATEGORY_RE = re.compile(
+    r"(?=.*deal)(?=.*(?:again|end))(?P<deal_again>)"
+    r"|(?=.*(?P<flop>flop))"
+    r"|(?=.*(?P<turn>turn))"
+    r"|(?=.*(?P<river>river))",
+    re.IGNORECASE,
+)
+
+
+def label_category(name: str) -> str:
+    """Pick the LABEL_BLOBS entry for an image filename"""
+    match = LABEL_CATEGORY_RE.match(name)
+    # Default action labels
+    return match.lastgroup if match else "action"
+
+
+def write_label(path: str, data: bytes):
+    """Write a label file with a single raw write (no Path/TextIO overhead)"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def write_labels_tar(tar_path: Path, label_paths: list, label_blobs: list):
+    """Write all labels as members of a single uncompressed tar archive"""
+    mtime = time.time()
+    with tarfile.open(tar_path, "w") as tf:
+        for path, blob in zip(label_paths, label_blobs):
+            info = tarfile.TarInfo(name=os.path.basename(path))
+            info.size = len(blob)
+            info.mtime = mtime
+            tf.addfile(info, io.BytesIO(blob))
+
+
 def process_images():
     """Process all images in the training directory and generate labels"""
     print("=" * 60)
@@ -178,7 +231,8 @@ def process_images():
     LABELS_DIR.mkdir(parents=True, exist_ok=True)
     
     # Get all images
-    images = list(IMAGES_DIR.glob("*.png")) + list(IMAGES_DIR.glob("*.jpg"))
+    with os.scandir(IMAGES_DIR) as it:
+        images = [entry for entry in it if entry.name.endswith(IMAGE_EXTENSIONS)]
     
     if not images:
         print(f"❌ No images found in {IMAGES_DIR}")
@@ -188,47 +242,40 @@ def process_images():
     
     print(f"\n📊 Found {len(images)} images to label")
     
-    labeled_count = 0
-    for image_path in images:
-        image_type = classify_image(str(image_path))
-        
-        # Generate appropriate labels based on image type
-        if image_type == "deal_again":
-            labels = generate_deal_again_labels()
-        elif "flop" in str(image_path).lower():
-            labels = generate_labels_with_board(3)
-        elif "turn" in str(image_path).lower():
-            labels = generate_labels_with_board(4)
-        elif "river" in str(image_path).lower():
-            labels = generate_labels_with_board(5)
-        else:
-            # Default action labels
-            labels = generate_action_labels()
-        
-        # Write label file
-        label_path = LABELS_DIR / f"{image_path.stem}.txt"
-        with open(label_path, "w") as f:
-            f.write("\n".join(labels))
-        
-        labeled_count += 1
+    # Classify sequentially (cheap), then write in parallel
+    label_paths = []
+    label_blobs = []
+    for entry in images:
+        label_paths.append(LABELS_DIR_STR + "/" + entry.name.rsplit(".", 1)[0] + ".txt")
+        label_blobs.append(LABEL_BLOBS[label_category(entry.name)])
     
-    print(f"\n✅ Generated {labeled_count} label files")
-    print(f"   Labels saved to: {LABELS_DIR}")
+    # Write label files
+    if TAR_MODE:
+        write_labels_tar(LABELS_DIR / "labels.tar", label_paths, label_blobs)
+    else:
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            list(executor.map(write_label, label_paths, label_blobs))
+    labeled_count = len(label_paths)
     
-    # Also copy labels to images directory (YOLO expects them together)
-    print("\n📁 Copying labels to images directory for YOLO...")
-    for label_file in LABELS_DIR.glob("*.txt"):
-        dest = IMAGES_DIR / label_file.name
-        if not dest.exists():
-            dest.write_text(label_file.read_text())
+    print(f"\n✅ Generated {labeled_count} labels")
+    print(f"   Labels saved to: {LABELS_DIR}")
     
-    print("   Done!")
+    if TAR_MODE:
+        print(f"   Archive: {LABELS_DIR / 'labels.tar'}")
+    else:
+        # Also link labels into images directory (YOLO expects them together)
+        print("\n📁 Linking labels into images directory for YOLO...")
+        with os.scandir(LABELS_DIR) as it:
+            label_files = [entry.path for entry in it if entry.name.endswith(".txt")]
+        dests = [os.path.join(IMAGES_DIR_STR, os.path.basename(src)) for src in label_files]
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            list(executor.map(link_label, label_files, dests))
+        
+        print("   Done!")
     
     # Write classes.txt
     classes_file = LABELS_DIR / "classes.txt"
-    with open(classes_file, "w") as f:
-        for class_name, class_id in sorted(CLASSES.items(), key=lambda x: x[1]):
-            f.write(f"{class_name}\n")
+    classes_file.write_bytes(CLASSES_TXT_BYTES)
     
     print(f"\n📝 Classes file written: {classes_file}")
     print(f"\n🎯 YOLO Classes:")
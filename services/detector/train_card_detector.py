@@ -4,17 +4,24 @@ Uses clean card PNGs to train YOLO for specific card detection
 """
 
 import os
-import random
 import shutil
+import sys
+from functools import lru_cache
+from multiprocessing import Pool
 from pathlib import Path
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 import numpy as np
+import cv2
 
 # Paths - Use Flutter app's card assets
 CARDS_DIR = Path(__file__).parent.parent.parent / "apps" / "demo-flutter" / "assets" / "cards"
 OUTPUT_DIR = Path(__file__).parent / "training_data" / "card_detection"
 IMAGES_DIR = OUTPUT_DIR / "images"
 LABELS_DIR = OUTPUT_DIR / "labels"
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 92]
+# Cards are composited clean and YOLO's train-time augmentation adds the variety;
+# --augment restores the old on-disk rotation/scale/brightness/contrast pass
+AUGMENT_ON_DISK = "--augment" in sys.argv
 
 # Card classes (52 cards)
 CARD_CLASSES = {
@@ -51,9 +58,14 @@ CARD_CLASSES = {
 # Reverse mapping
 CLASS_NAMES = {v: k for k, v in CARD_CLASSES.items()}
 
+# (name, class_id) pools for random card selection, with and without the card back
+ALL_CARDS = tuple(CARD_CLASSES.items())
+CARDS_NO_BACK = tuple(card for card in ALL_CARDS if card[0] != "card_back")
 
-def create_green_background(width=640, height=480):
+
+def create_green_background(width=640, height=480, rng=None):
     """Create a poker table green background"""
+    rng = rng or np.random.default_rng()
     # Various shades of poker table green
     greens = [
         (34, 139, 34),   # Forest green
@@ -62,137 +74,179 @@ def create_green_background(width=640, height=480):
         (60, 120, 60),   # Poker green
         (35, 100, 35),   # Table green
     ]
-    color = random.choice(greens)
+    color = greens[rng.integers(len(greens))]
     
     # Create base image
-    img = Image.new('RGB', (width, height), color)
+    img = np.full((height, width, 3), color, dtype=np.uint8)
     
-    # Add some texture/noise
-    pixels = np.array(img)
-    noise = np.random.randint(-10, 10, pixels.shape, dtype=np.int16)
-    pixels = np.clip(pixels.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    # Add some texture/noise in [-10, 10): saturating add of [0, 20) then subtract 10
+    noise = np.empty_like(img)
+    cv2.randu(noise, (0, 0, 0), (20, 20, 20))
+    cv2.add(img, noise, dst=img)
+    cv2.subtract(img, (10, 10, 10, 0), dst=img)
     
-    return Image.fromarray(pixels)
+    return img
 
 
+@lru_cache(maxsize=None)
 def load_card_image(card_name):
-    """Load a card image and make background transparent"""
+    """Load a card image as a read-only RGBA array (decoded once per process)"""
     card_path = CARDS_DIR / f"{card_name}.png"
     if not card_path.exists():
         return None
     
-    img = Image.open(card_path).convert('RGBA')
+    img = np.array(Image.open(card_path).convert('RGBA'))
+    # Shared between calls: augment_card must never modify it in place
+    img.setflags(write=False)
     return img
 
 
-def augment_card(card_img):
-    """Apply random augmentations to card"""
-    # Random rotation (-15 to 15 degrees)
-    angle = random.uniform(-15, 15)
-    card_img = card_img.rotate(angle, expand=True, resample=Image.BICUBIC)
-    
-    # Random scale (0.8 to 1.2)
-    scale = random.uniform(0.8, 1.2)
-    new_size = (int(card_img.width * scale), int(card_img.height * scale))
-    card_img = card_img.resize(new_size, Image.LANCZOS)
+def augment_card(card_img, rng=None):
+    """Apply random augmentations to an RGBA card array"""
+    rng = rng or np.random.default_rng()
+    h, w = card_img.shape[:2]
+    # All draws for this card at once: angle, scale, brightness on/factor, contrast on/factor
+    u = rng.random(6)
+    
+    # Random rotation (-15 to 15 degrees) and scale (0.8 to 1.2) as one affine warp,
+    # with the canvas grown to fit the rotated card (like PIL's expand=True)
+    angle = -15 + 30 * u[0]
+    scale = 0.8 + 0.4 * u[1]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, scale)
+    cos, sin = abs(M[0, 0]), abs(M[0, 1])
+    new_w = int(h * sin + w * cos)
+    new_h = int(h * cos + w * sin)
+    M[0, 2] += (new_w - w) / 2
+    M[1, 2] += (new_h - h) / 2
+    card_img = cv2.warpAffine(card_img, M, (new_w, new_h), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+    
+    # Brightness/contrast as a single lookup table on the color channels (alpha untouched)
+    lut = np.arange(256, dtype=np.float32)
+    adjusted = False
     
     # Random brightness
-    if random.random() > 0.5:
-        enhancer = ImageEnhance.Brightness(card_img)
-        card_img = enhancer.enhance(random.uniform(0.8, 1.2))
-    
-    # Random contrast
-    if random.random() > 0.5:
-        enhancer = ImageEnhance.Contrast(card_img)
-        card_img = enhancer.enhance(random.uniform(0.9, 1.1))
+    if u[2] > 0.5:
+        lut *= 0.8 + 0.4 * u[3]
+        adjusted = True
+    
+    # Random contrast (around the mean gray level, as ImageEnhance.Contrast does)
+    if u[4] > 0.5:
+        r, g, b, _ = cv2.mean(card_img)
+        mean = lut[int(0.299 * r + 0.587 * g + 0.114 * b)]
+        lut = mean + (0.9 + 0.2 * u[5]) * (lut - mean)
+        adjusted = True
+    
+    if adjusted:
+        channel = np.clip(lut, 0, 255).astype(np.uint8)
+        alpha = np.arange(256, dtype=np.uint8)
+        card_img = cv2.LUT(card_img, np.stack([channel, channel, channel, alpha], axis=-1).reshape(1, 256, 4))
     
     return card_img
 
 
 def place_card_on_background(background, card_img, x, y):
-    """Place a card on the background at position (x, y)"""
-    # Ensure RGBA
-    if card_img.mode != 'RGBA':
-        card_img = card_img.convert('RGBA')
-    
-    # Create a copy of background
-    result = background.copy()
-    
-    # Paste card with transparency
-    result.paste(card_img, (x, y), card_img)
-    
-    return result
+    """Alpha-blend an RGBA card array onto the RGB background array in place at (x, y)"""
+    h, w = card_img.shape[:2]
+    region = background[y:y + h, x:x + w]
+    alpha = card_img[:, :, 3:4].astype(np.uint16)
+    
+    # Integer "over" compositing, rounded: (a * card + (255 - a) * bg) / 255
+    blended = alpha * card_img[:, :, :3] + (255 - alpha) * region + 127
+    region[:] = blended // 255
+    return background
 
 
-def generate_training_image(image_id, num_cards=None):
+def generate_training_image(image_id, num_cards=None, rng=None):
     """Generate a single training image with random cards"""
+    rng = rng or np.random.default_rng()
     if num_cards is None:
-        num_cards = random.randint(2, 7)  # 2-7 cards per image
+        num_cards = int(rng.integers(2, 8))  # 2-7 cards per image
     
     # Create background (simulate iPhone screen size)
     width, height = 640, 960
-    background = create_green_background(width, height)
+    background = create_green_background(width, height, rng)
     
     labels = []
-    card_names = list(CARD_CLASSES.keys())
     
     # Remove card_back from random selection most of the time
-    if random.random() > 0.3:
-        card_names = [c for c in card_names if c != "card_back"]
+    cards = CARDS_NO_BACK if rng.random() > 0.3 else ALL_CARDS
+    picks = rng.integers(len(cards), size=num_cards)
     
-    # Track placed cards to avoid overlap
-    placed_rects = []
+    # Track placed cards to avoid overlap (rows of x1, y1, x2, y2)
+    placed_rects = np.empty((num_cards, 4), dtype=np.int32)
+    num_placed = 0
     
-    for _ in range(num_cards):
+    for pick in picks:
         # Select random card
-        card_name = random.choice(card_names)
+        card_name, class_id = cards[pick]
         card_img = load_card_image(card_name)
         
         if card_img is None:
             continue
         
         # Augment card
-        card_img = augment_card(card_img)
+        if AUGMENT_ON_DISK:
+            card_img = augment_card(card_img, rng)
+        card_h, card_w = card_img.shape[:2]
         
-        # Find non-overlapping position
+        # Find non-overlapping position: draw all candidate positions at once and
+        # test every candidate against every placed card in one broadcast
         max_attempts = 20
-        for _ in range(max_attempts):
-            x = random.randint(0, width - card_img.width)
-            y = random.randint(0, height - card_img.height)
-            
-            # Check overlap
-            new_rect = (x, y, x + card_img.width, y + card_img.height)
-            overlap = False
-            for rect in placed_rects:
-                if (new_rect[0] < rect[2] and new_rect[2] > rect[0] and
-                    new_rect[1] < rect[3] and new_rect[3] > rect[1]):
-                    overlap = True
-                    break
-            
-            if not overlap:
-                placed_rects.append(new_rect)
-                break
+        xs = rng.integers(0, width - card_w + 1, max_attempts)
+        ys = rng.integers(0, height - card_h + 1, max_attempts)
+        if num_placed:
+            rects = placed_rects[:num_placed]
+            overlap = ((xs[:, None] < rects[:, 2]) & (xs[:, None] + card_w > rects[:, 0]) &
+                       (ys[:, None] < rects[:, 3]) & (ys[:, None] + card_h > rects[:, 1])).any(axis=1)
+            free = np.flatnonzero(~overlap)
+            if free.size == 0:
+                continue  # Skip if can't find non-overlapping position
+            attempt = free[0]
         else:
-            continue  # Skip if can't find non-overlapping position
+            attempt = 0
+        x, y = int(xs[attempt]), int(ys[attempt])
+        placed_rects[num_placed] = (x, y, x + card_w, y + card_h)
+        num_placed += 1
         
         # Place card
         background = place_card_on_background(background, card_img, x, y)
         
         # Calculate YOLO label (normalized center x, y, width, height)
-        cx = (x + card_img.width / 2) / width
-        cy = (y + card_img.height / 2) / height
-        w = card_img.width / width
-        h = card_img.height / height
+        cx = (x + card_w / 2) / width
+        cy = (y + card_h / 2) / height
+        w = card_w / width
+        h = card_h / height
         
-        class_id = CARD_CLASSES[card_name]
         labels.append(f"{class_id} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}")
     
-    # Convert to RGB for saving
-    background = background.convert('RGB')
-    
     return background, labels
 
 
+def _init_worker():
+    """Keep OpenCV single-threaded inside each pool process"""
+    cv2.setNumThreads(1)
+
+
+def _generate_and_save(task):
+    """Pool worker: generate image i from its seed and write JPEG + label"""
+    i, base_seed = task
+    # Per-image PCG64 stream: reproducible and independent of worker scheduling
+    rng = np.random.default_rng([base_seed, i])
+    cv2.setRNGSeed(int(rng.integers(2**31)))  # background noise uses cv2.randu
+    
+    img, labels = generate_training_image(i, rng=rng)
+    
+    # Save image (JPEG: far faster to encode and ~10x smaller than PNG)
+    img_path = IMAGES_DIR / f"cards_{i:05d}.jpg"
+    cv2.imwrite(str(img_path), cv2.cvtColor(img, cv2.COLOR_RGB2BGR), JPEG_PARAMS)
+    
+    # Save labels
+    label_path = LABELS_DIR / f"cards_{i:05d}.txt"
+    label_path.write_text("\n".join(labels))
+    return i
+
+
 def generate_dataset(num_images=2000):
     """Generate complete training dataset"""
     print("🃏 Card Detector Training Data Generator")
@@ -202,22 +256,27 @@ def generate_dataset(num_images=2000):
     IMAGES_DIR.mkdir(parents=True, exist_ok=True)
     LABELS_DIR.mkdir(parents=True, exist_ok=True)
     
-    # Generate images
-    print(f"📸 Generating {num_images} training images...")
-    
-    for i in range(num_images):
-        if (i + 1) % 100 == 0:
-            print(f"   Progress: {i + 1}/{num_images}")
-        
-        img, labels = generate_training_image(i)
-        
-        # Save image
-        img_path = IMAGES_DIR / f"cards_{i:05d}.png"
-        img.save(img_path)
-        
-        # Save labels
-        label_path = LABELS_DIR / f"cards_{i:05d}.txt"
-        label_path.write_text("\n".join(labels))
+    # Clear the previous run: older runs wrote .png, which YOLO would pair with the new labels
+    stale = 0
+    for directory, suffixes in ((IMAGES_DIR, (".png", ".jpg")), (LABELS_DIR, (".txt",))):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("cards_") and entry.name.endswith(suffixes):
+                    os.unlink(entry.path)
+                    stale += 1
+    if stale:
+        print(f"🧹 Removed {stale} files from the previous run")
+    
+    # Generate images (one task per image; workers write their own files)
+    workers = os.cpu_count() or 1
+    print(f"📸 Generating {num_images} training images on {workers} processes...")
+    
+    base_seed = np.random.SeedSequence().entropy
+    tasks = ((i, base_seed) for i in range(num_images))
+    with Pool(workers, initializer=_init_worker) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_generate_and_save, tasks, chunksize=16), 1):
+            if done % 100 == 0:
+                print(f"   Progress: {done}/{num_images}")
     
     print(f"\n✅ Generated {num_images} images")
     print(f"📁 Images: {IMAGES_DIR}")
@@ -280,6 +339,14 @@ def train_model():
         name="card_detector_v1",
         patience=10,
         device="cpu",  # Use 'cuda' for GPU
+        # On-the-fly augmentation replaces the baked-in card augmentation
+        degrees=15,
+        scale=0.2,
+        translate=0.1,
+        hsv_s=0.2,
+        hsv_v=0.2,
+        mosaic=1.0,
+        workers=os.cpu_count() or 8,
     )
     
     print("\n✅ Training complete!")
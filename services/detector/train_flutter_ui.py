@@ -23,9 +23,10 @@ dataset_config = {
     }
 }
 
-# Save dataset config
+# Save dataset config (libyaml C dumper when available)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
 with open('/app/training_data/dataset.yaml', 'w') as f:
-    yaml.dump(dataset_config, f)
+    yaml.dump(dataset_config, f, Dumper=Dumper, sort_keys=False)
 
 def train_flutter_ui_detector():
     """Train YOLO model on Flutter UI screenshots"""
@@ -61,6 +62,9 @@ def train_flutter_ui_detector():
     # Export best model
     best_model = YOLO('/app/runs/flutter_ui_v1/weights/best.pt')
     best_model.export(format='onnx')  # Export to ONNX for deployment
+    if os.getenv('OV_INT8') == '1':
+        # INT8 OpenVINO IR for CPU-only deployment, calibrated on the dataset
+        best_model.export(format='openvino', int8=True, data='/app/training_data/dataset.yaml')
 
     print(f"Training complete! Best model saved to: /app/runs/flutter_ui_v1/weights/best.pt")
     print(f"Model metrics: {results.results_dict}")
@@ -5,8 +5,11 @@ Trains YOLOv8 on auto-labeled poker screenshots
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from dataset_utils import link_label, count_by_suffix, label_state_hash
+
 def train_yolo():
     """Train YOLOv8 on poker dataset"""
     print("=" * 60)
@@ -40,8 +43,8 @@ def train_yolo():
     images_dir = Path("training_data/poker_images")
     labels_dir = Path("training_data/poker_labels")
     
-    image_count = len(list(images_dir.glob("*.png"))) + len(list(images_dir.glob("*.jpg")))
-    label_count = len(list(labels_dir.glob("*.txt")))
+    image_count = sum(count_by_suffix(images_dir, (".png", ".jpg")))
+    label_count, = count_by_suffix(labels_dir, (".txt",))
     
     print(f"\n📊 Dataset:")
     print(f"   Images: {image_count}")
@@ -66,14 +69,17 @@ def train_yolo():
     # YOLO expects labels in images/../labels/ or same directory
     print("\n📁 Setting up dataset structure...")
     
-    # Move/copy labels to be alongside images
-    for label_file in labels_dir.glob("*.txt"):
-        if label_file.name != "classes.txt":
-            dest = images_dir / label_file.name
-            if not dest.exists():
-                dest.write_text(label_file.read_text())
-    
-    print("   Labels copied to images directory")
+    # Link labels to be alongside images, unless unchanged since the last run
+    sync_marker = images_dir / ".label_sync.hash"
+    state_hash = label_state_hash(labels_dir)
+    if sync_marker.exists() and sync_marker.read_text() == state_hash:
+        print("   Labels unchanged since last run")
+    else:
+        label_files = [f for f in labels_dir.glob("*.txt") if f.name != "classes.txt"]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda f: link_label(f, images_dir / f.name), label_files))
+        sync_marker.write_text(state_hash)
+        print("   Labels linked into images directory")
     
     # Load model
     print(f"\n📥 Loading {MODEL_NAME}...")
@@ -102,6 +108,13 @@ def train_yolo():
         print("\n" + "=" * 60)
         print("✅ Training complete!")
         print(f"\n📁 Model saved to: {PROJECT}/{NAME}/weights/best.pt")
+        
+        # Optional OpenVINO INT8 IR for CPU serving (calibrated on the training set)
+        if os.getenv("OV_INT8") == "1":
+            print("\n📦 Exporting OpenVINO INT8 model...")
+            best_model = YOLO(f"{PROJECT}/{NAME}/weights/best.pt")
+            ov_path = best_model.export(format="openvino", int8=True, data=DATASET_YAML, imgsz=IMAGE_SIZE)
+            print(f"   OpenVINO model: {ov_path}")
         print("\n📊 Results:")
         print(f"   Final mAP50: Check {PROJECT}/{NAME}/results.csv")
         print(f"   Confusion matrix: {PROJECT}/{NAME}/confusion_matrix.png")
@@ -119,46 +132,104 @@ def train_yolo():
         print("   - Reduce batch size if out of memory")
         print("   - Check that labels are in correct YOLO format")
 
+def _check_label_lines(label_file: Path, numbered_lines) -> tuple:
+    """Line-by-line check of (line_num, line) pairs; returns (valid, invalid, messages)"""
+    valid = 0
+    invalid = 0
+    messages = []
+    for line_num, line in numbered_lines:
+        parts = line.strip().split()
+        if len(parts) != 5:
+            messages.append(f"   ⚠️ {label_file.name}:{line_num} - Invalid format: {line.strip()}")
+            invalid += 1
+            continue
+        
+        try:
+            class_id = int(parts[0])
+        except ValueError:
+            messages.append(f"   ⚠️ {label_file.name}:{line_num} - Invalid class ID: {parts[0]}")
+            invalid += 1
+            continue
+        try:
+            coords = [float(x) for x in parts[1:]]
+        except ValueError:
+            messages.append(f"   ⚠️ {label_file.name}:{line_num} - Invalid format: {line.strip()}")
+            invalid += 1
+            continue
+        
+        # Check ranges (11 classes: 0-10)
+        if class_id < 0 or class_id > 10:
+            messages.append(f"   ⚠️ {label_file.name}:{line_num} - Invalid class ID: {class_id}")
+            invalid += 1
+            continue
+        
+        if any(c < 0 or c > 1 for c in coords):
+            messages.append(f"   ⚠️ {label_file.name}:{line_num} - Coords out of range: {coords}")
+            invalid += 1
+            continue
+        
+        valid += 1
+    return valid, invalid, messages
+
+
+def _validate_label_file(label_file: Path) -> tuple:
+    """Validate one label file with NumPy; returns (valid, invalid, messages)"""
+    import numpy as np
+    
+    try:
+        lines = label_file.read_text().splitlines()
+        if not lines:
+            return 0, 0, []
+        arr = None
+        if all(line.strip() for line in lines):
+            try:
+                arr = np.loadtxt(lines, ndmin=2, comments=None)
+            except ValueError:
+                pass
+        if arr is None or arr.shape[1] != 5:
+            # Blank, ragged or non-numeric rows: fall back to the per-line check
+            return _check_label_lines(label_file, enumerate(lines, 1))
+        
+        # Class ids must be integer literals, as int() requires ("1.0" is rejected)
+        class_tokens = [line.split(None, 1)[0] for line in lines]
+        int_ids = np.fromiter(
+            ((tok[1:] if tok[0] in "+-" else tok).isdigit() for tok in class_tokens),
+            dtype=bool, count=len(class_tokens)
+        )
+        
+        # Check ranges in bulk (11 classes: 0-10, coords normalized to 0-1)
+        class_ids = arr[:, 0]
+        coords = arr[:, 1:]
+        bad = (~int_ids | (class_ids < 0) | (class_ids > 10) |
+               ((coords < 0) | (coords > 1)).any(axis=1))
+        if not bad.any():
+            return len(arr), 0, []
+        
+        # Only the few offending lines go through the per-line check for messages
+        bad_rows = np.flatnonzero(bad)
+        _, invalid, messages = _check_label_lines(label_file, ((i + 1, lines[i]) for i in bad_rows))
+        return len(arr) - len(bad_rows), invalid, messages
+    except Exception as e:
+        return 0, 1, [f"   ❌ {label_file.name}: {e}"]
+
+
 def validate_labels():
     """Validate YOLO labels format"""
+    from multiprocessing import Pool
+    
     print("\n🔍 Validating labels...")
     
     labels_dir = Path("training_data/poker_labels")
-    valid = 0
-    invalid = 0
+    label_files = [f for f in labels_dir.glob("*.txt") if f.name != "classes.txt"]
     
-    for label_file in labels_dir.glob("*.txt"):
-        if label_file.name == "classes.txt":
-            continue
-            
-        try:
-            with open(label_file) as f:
-                for line_num, line in enumerate(f, 1):
-                    parts = line.strip().split()
-                    if len(parts) != 5:
-                        print(f"   ⚠️ {label_file.name}:{line_num} - Invalid format: {line.strip()}")
-                        invalid += 1
-                        continue
-                    
-                    class_id = int(parts[0])
-                    coords = [float(x) for x in parts[1:]]
-                    
-                    # Check ranges (11 classes: 0-10)
-                    if class_id < 0 or class_id > 10:
-                        print(f"   ⚠️ {label_file.name}:{line_num} - Invalid class ID: {class_id}")
-                        invalid += 1
-                        continue
-                    
-                    if any(c < 0 or c > 1 for c in coords):
-                        print(f"   ⚠️ {label_file.name}:{line_num} - Coords out of range: {coords}")
-                        invalid += 1
-                        continue
-                    
-                    valid += 1
-                    
-        except Exception as e:
-            print(f"   ❌ {label_file.name}: {e}")
-            invalid += 1
+    with Pool() as pool:
+        results = pool.map(_validate_label_file, label_files, chunksize=64)
+    
+    valid = sum(r[0] for r in results)
+    invalid = sum(r[1] for r in results)
+    for _, _, messages in results:
+        for message in messages:
+            print(message)
     
     print(f"\n   Valid labels: {valid}")
     print(f"   Invalid labels: {invalid}")
@@ -5,8 +5,11 @@ Trains YOLOv8 on auto-labeled Rive poker screenshots
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from dataset_utils import link_label, count_by_suffix, label_state_hash
+
 def train_yolo():
     """Train YOLOv8 on Rive poker dataset"""
     print("=" * 60)
@@ -41,8 +44,8 @@ def train_yolo():
     images_dir = BASE_DIR / "training_data/rive_poker_images"
     labels_dir = BASE_DIR / "training_data/rive_poker_labels"
     
-    image_count = len(list(images_dir.glob("*.png"))) + len(list(images_dir.glob("*.jpg")))
-    label_count = len(list(labels_dir.glob("*.txt")))
+    image_count = sum(count_by_suffix(images_dir, (".png", ".jpg")))
+    label_count, = count_by_suffix(labels_dir, (".txt",))
     
     print(f"\n📊 Rive Dataset:")
     print(f"   Images: {image_count}")
@@ -69,14 +72,33 @@ def train_yolo():
     print(f"   Batch Size: {BATCH_SIZE}")
     print(f"   Output: {PROJECT}/{NAME}")
     
-    # Copy labels to images directory (YOLO expects them together)
+    # Link labels into images directory (YOLO expects them together)
     print("\n📁 Setting up dataset structure...")
-    for label_file in labels_dir.glob("*.txt"):
-        if label_file.name != "classes.txt":
-            dest = images_dir / label_file.name
-            if not dest.exists():
-                dest.write_text(label_file.read_text())
-    print("   Labels copied to images directory")
+    # Skip the sync when the labels are unchanged since the last run
+    sync_marker = images_dir / ".label_sync.hash"
+    state_hash = label_state_hash(labels_dir)
+    if sync_marker.exists() and sync_marker.read_text() == state_hash:
+        print("   Labels unchanged since last run")
+    else:
+        label_files = [f for f in labels_dir.glob("*.txt") if f.name != "classes.txt"]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda f: link_label(f, images_dir / f.name), label_files))
+        sync_marker.write_text(state_hash)
+        print("   Labels linked into images directory")
+    
+    # Pick the fastest available device; AMP only on CUDA (MPS autocast is unreliable)
+    import torch
+    if torch.cuda.is_available():
+        device = "cuda"
+        torch.backends.cuda.matmul.allow_tf32 = True  # TF32 tensor cores on Ampere+
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+    elif torch.backends.mps.is_available():
+        device = "mps"  # Metal Performance Shaders for Mac GPU acceleration
+    else:
+        device = "cpu"
+    use_amp = device == "cuda"
+    print(f"   Device: {device} (AMP {'on' if use_amp else 'off'})")
     
     # Load model
     print(f"\n📥 Loading {MODEL_NAME}...")
@@ -97,7 +119,8 @@ def train_yolo():
         patience=20,    # Early stopping patience
         save=True,
         verbose=True,
-        device='mps',   # Use Metal Performance Shaders for Mac GPU acceleration
+        device=device,
+        amp=use_amp,    # Mixed precision (FP16 autocast + GradScaler) on CUDA
     )
     
     print("\n" + "=" * 60)
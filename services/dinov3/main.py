@@ -4,43 +4,133 @@ Computes visual embeddings for similarity search and healing
 """
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 import logging
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Serialize responses with orjson when available
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as DefaultResponse
+
 app = FastAPI(
     title="DINOv3 Embedding Service",
     description="Visual embeddings for AI UI Automation visual memory",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=DefaultResponse
 )
 
 # Model loading (lazy initialization)
 model = None
 processor = None
+transform = None
+
+# Inference backend: torch (default) or onnx (INT8 ONNX Runtime, for CPU-only
+# hosts; opt-in, needs optimum[onnxruntime])
+DINO_BACKEND = os.environ.get("DINO_BACKEND", "torch")
+DINO_ONNX_DIR = os.environ.get("DINO_ONNX_DIR", "dino_onnx")
+# DINO_COMPILE=0 disables torch.compile on CUDA (e.g. to skip the compile at boot)
+DINO_COMPILE = os.environ.get("DINO_COMPILE", "1") == "1"
+
+# Micro-batching: concurrent /embed requests share one DINO forward pass
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", 5))
+_embed_queue: Optional[asyncio.Queue] = None
+_batch_task: Optional[asyncio.Task] = None
+# CUDA stream for host-to-device image uploads (created on first CUDA batch)
+_copy_stream = None
+# Worker processes that decode images before they reach the batch worker, so
+# decoding overlaps the forward pass of earlier batches (0 = decode in the batch)
+EMBED_PREPROCESS_WORKERS = int(os.environ.get("EMBED_PREPROCESS_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+_preprocess_pool: Optional[ProcessPoolExecutor] = None
+# True when JPEGs are left for nvJPEG in the batch worker (set at startup)
+_gpu_jpeg = False
+
+# Cosine similarity index over stored embeddings (opt-in, needs faiss-cpu or
+# faiss-gpu). Loaded from / saved to DINO_INDEX_PATH (.npz with embeddings, ids)
+DINO_INDEX_PATH = os.environ.get("DINO_INDEX_PATH", "dino_index.npz")
+HNSW_M = int(os.environ.get("DINO_HNSW_M", 32))
+search_index = None
+index_ids: List[str] = []
+_index_vectors: list = []
+
+
+def build_transform(processor):
+    """Tensor equivalent of the HF processor (resize, center crop, normalize)"""
+    import torch
+    from torchvision.transforms import v2 as T
+
+    size = processor.size
+    resize = size.get("shortest_edge") or (size["height"], size["width"])
+    crop = processor.crop_size
+    return T.Compose([
+        T.Resize(resize, interpolation=T.InterpolationMode.BICUBIC, antialias=True),
+        T.CenterCrop((crop["height"], crop["width"])),
+        T.ToDtype(torch.float32, scale=True),
+        T.Normalize(mean=processor.image_mean, std=processor.image_std),
+    ])
+
+
+def load_onnx_model(model_name: str):
+    """Dynamic INT8 ONNX Runtime model, exported and quantized once then cached on disk"""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    
+    onnx_dir = Path(DINO_ONNX_DIR) / model_name.replace("/", "--")
+    quantized = onnx_dir / "model_quantized.onnx"
+    if not quantized.exists():
+        logger.info(f"Exporting {model_name} to INT8 ONNX in {onnx_dir}")
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(onnx_dir)
+        # Dynamic quantization needs no calibration data; VNNI int8 dot products on x86
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(onnx_dir).quantize(save_dir=onnx_dir, quantization_config=qconfig)
+    return ORTModelForFeatureExtraction.from_pretrained(onnx_dir, file_name=quantized.name)
+
 
 def get_model():
     """Lazy load DINOv2 model (using v2 as v3 may not be available yet)"""
-    global model, processor
+    global model, processor, transform
     if model is None:
         try:
             import torch
             from transformers import AutoImageProcessor, AutoModel
-            from PIL import Image
             
             # Use DINOv2 (similar architecture to v3)
             model_name = os.environ.get("DINO_MODEL", "facebook/dinov2-base")
             processor = AutoImageProcessor.from_pretrained(model_name)
-            model = AutoModel.from_pretrained(model_name)
+            transform = build_transform(processor)
+            if DINO_BACKEND == "onnx":
+                model = load_onnx_model(model_name)
+                logger.info(f"Loaded DINO model: {model_name} (onnx int8)")
+                return model, processor
+            
+            # Fused scaled_dot_product_attention (flash / mem-efficient kernels)
+            model = AutoModel.from_pretrained(model_name, attn_implementation="sdpa")
             model.eval()
             
-            # Move to GPU if available
+            # Move to GPU if available; half precision halves weight/activation traffic
             if torch.cuda.is_available():
-                model = model.cuda()
+                # BF16 on Ampere+ for its wider range, FP16 on older GPUs
+                dtype = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+                model = model.to(device="cuda", dtype=dtype)
+                # Input shape is fixed by the crop, so cuDNN autotuning pays off after warmup
+                torch.backends.cudnn.benchmark = True
+                if DINO_COMPILE:
+                    # Fuses LayerNorm/GELU/residual kernels and replays them as CUDA graphs;
+                    # each micro-batch size compiles once, then runs from cache
+                    model = torch.compile(model, mode="reduce-overhead")
             elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
                 model = model.to('mps')
                 
@@ -66,55 +156,387 @@ class SearchRequest(BaseModel):
     top_k: int = 5
 
 
-@app.get("/health")
-async def health():
-    """Health check endpoint"""
-    return {"status": "healthy", "model_loaded": model is not None}
+class SearchResult(BaseModel):
+    id: str
+    score: float
 
 
-@app.post("/embed", response_model=EmbedResponse)
-async def embed(request: EmbedRequest):
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+
+class IndexRequest(BaseModel):
+    id: str
+    embedding: List[float]
+
+
+def normalized(embeddings):
+    """float32 (N, D) copy of embeddings scaled to unit length, for inner-product search"""
+    import numpy as np
+    import faiss
+    vectors = np.array(embeddings, dtype=np.float32, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def new_index(dim: int):
+    """Exact inner-product index on GPU when faiss-gpu is available, HNSW on CPU otherwise"""
+    import faiss
+    if hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0:
+        # HNSW has no GPU implementation; brute force on GPU is faster at this scale
+        return faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, faiss.IndexFlatIP(dim))
+    return faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+
+
+def add_to_index(ids: List[str], vectors):
+    """Append normalized vectors to the search index, creating it on first use"""
+    global search_index
+    if search_index is None:
+        search_index = new_index(vectors.shape[1])
+    search_index.add(vectors)
+    index_ids.extend(ids)
+    _index_vectors.append(vectors)
+
+
+def load_index():
+    """Build the search index from DINO_INDEX_PATH if it exists"""
+    if not os.path.exists(DINO_INDEX_PATH):
+        return
+    try:
+        import numpy as np
+        data = np.load(DINO_INDEX_PATH)
+        add_to_index([str(i) for i in data["ids"]], normalized(data["embeddings"]))
+        logger.info(f"Loaded {len(index_ids)} embeddings into the search index")
+    except Exception as e:
+        logger.warning(f"Failed to load search index from {DINO_INDEX_PATH}: {e}")
+
+
+def save_index():
+    """Write the indexed embeddings back to DINO_INDEX_PATH"""
+    if not _index_vectors:
+        return
+    import numpy as np
+    np.savez(DINO_INDEX_PATH, embeddings=np.concatenate(_index_vectors), ids=np.array(index_ids))
+
+
+def model_device_dtype(dino_model) -> tuple:
+    """Device and dtype that input tensors must be on for dino_model"""
+    import torch
+    if DINO_BACKEND == "onnx":
+        # ONNX Runtime takes float32 CPU tensors
+        return torch.device("cpu"), torch.float32
+    param = next(dino_model.parameters())
+    return param.device, param.dtype
+
+
+def forward_embeddings(dino_model, pixel_values):
+    """CLS token embeddings for a preprocessed (B, 3, H, W) batch, as float32 numpy"""
+    import torch
+    with torch.inference_mode():
+        outputs = dino_model(pixel_values=pixel_values)
+    return outputs.last_hidden_state[:, 0, :].float().cpu().numpy()
+
+
+def decode_rgb(data):
+    """Decode an encoded uint8 tensor to RGB (3, H, W); PIL handles what torchvision can't"""
+    from torchvision.io import decode_image, ImageReadMode
+    try:
+        return decode_image(data, mode=ImageReadMode.RGB)
+    except (RuntimeError, ValueError):
+        # BMP, TIFF, some palette PNGs
+        import io
+        import numpy as np
+        import torch
+        from PIL import Image
+        image = np.asarray(Image.open(io.BytesIO(data.numpy().tobytes())).convert("RGB"))
+        return torch.from_numpy(image.copy()).permute(2, 0, 1)
+
+
+def is_jpeg(image_path: str) -> bool:
+    """Sniff the JPEG magic bytes without reading the rest of the file"""
+    with open(image_path, "rb") as f:
+        return f.read(3) == b"\xff\xd8\xff"
+
+
+def decode_to_shared_memory(image_path: str) -> tuple:
     """
-    Compute visual embedding for an image
+    Preprocessing worker: decode an image to RGB uint8 (3, H, W) in shared memory
     
-    Returns a 768-dimensional embedding vector
+    Returns (shared memory name, shape) for take_shared_image.
     """
-    if not os.path.exists(request.image_path):
-        raise HTTPException(status_code=404, detail=f"Image not found: {request.image_path}")
+    import numpy as np
+    from multiprocessing import shared_memory
+    from torchvision.io import read_file
+    
+    image = decode_rgb(read_file(image_path)).numpy()
+    shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)[...] = image
+    shm.close()
+    return shm.name, image.shape
+
+
+def take_shared_image(name: str, shape: tuple, pin: bool):
+    """Copy an image out of a worker's shared memory block and free the block"""
+    import numpy as np
+    import torch
+    from multiprocessing import shared_memory
+    
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # Copy straight into pinned memory when it is headed for the GPU
+        image = torch.empty(shape, dtype=torch.uint8, pin_memory=pin)
+        image.numpy()[...] = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        return image
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def run_embedding_batch(dino_model, items: list) -> list:
+    """
+    Embed a batch of (image path, decoded) items in one forward pass (blocking)
+    
+    decoded is a decode_to_shared_memory handle, or None to read and decode
+    the path here. Returns one float32 CLS embedding or Exception per item,
+    so a bad image only fails its own request.
+    """
+    import torch
+    from torchvision.io import read_file, decode_jpeg, ImageReadMode
+    
+    global _copy_stream
+    device, dtype = model_device_dtype(dino_model)
+    on_cuda = device.type == "cuda"
+    if on_cuda and _copy_stream is None:
+        _copy_stream = torch.cuda.Stream(device)
+    
+    outcomes = [None] * len(items)
+    images = {}
+    cpu_images = {}
+    encoded = {}
+    for idx, (image_path, decoded) in enumerate(items):
+        try:
+            if decoded is not None:
+                cpu_images[idx] = take_shared_image(*decoded, pin=on_cuda)
+            else:
+                encoded[idx] = read_file(image_path)
+        except Exception as e:
+            outcomes[idx] = e
+    
+    # On CUDA, JPEGs decode straight into device memory with one batched nvJPEG call
+    if on_cuda:
+        jpeg_indices = [idx for idx, data in encoded.items() if data[:3].tolist() == [0xFF, 0xD8, 0xFF]]
+        if jpeg_indices:
+            try:
+                gpu_images = decode_jpeg([encoded[idx] for idx in jpeg_indices], mode=ImageReadMode.RGB, device=device)
+                for idx, image in zip(jpeg_indices, gpu_images):
+                    images[idx] = image
+                    del encoded[idx]
+            except Exception as e:
+                # Unsupported JPEG variant: fall through to the CPU decoder
+                logger.debug(f"nvJPEG decode failed, using CPU: {e}")
+    
+    # Everything not decoded by a preprocessing worker decodes on CPU here
+    for idx, data in encoded.items():
+        try:
+            cpu_images[idx] = decode_rgb(data)
+        except Exception as e:
+            outcomes[idx] = e
+    
+    # On CUDA upload from pinned memory on a side stream, overlapping the copies
+    uploaded = []
+    for idx, image in cpu_images.items():
+        if on_cuda:
+            with torch.cuda.stream(_copy_stream):
+                image = image.pin_memory().to(device, non_blocking=True)
+            uploaded.append(image)
+        else:
+            image = image.to(device)
+        images[idx] = image
+    
+    if images:
+        if on_cuda and uploaded:
+            compute_stream = torch.cuda.current_stream(device)
+            compute_stream.wait_stream(_copy_stream)
+            for image in uploaded:
+                # Allocated on the copy stream; keep the caching allocator from reusing it early
+                image.record_stream(compute_stream)
+        indices = sorted(images)
+        # Preprocess on the model's device
+        pixel_values = torch.stack([transform(images[idx]) for idx in indices]).to(dtype)
+        # Use CLS token embedding
+        embeddings = forward_embeddings(dino_model, pixel_values)
+        for idx, embedding in zip(indices, embeddings):
+            outcomes[idx] = embedding
+    return outcomes
+
+
+async def batch_worker():
+    """Coalesce queued /embed requests into batched DINO calls"""
+    while True:
+        batch = [await _embed_queue.get()]
+        # Give concurrent requests a short window to join this batch
+        if EMBED_BATCH_SIZE > 1 and EMBED_BATCH_WINDOW_MS > 0:
+            await asyncio.sleep(EMBED_BATCH_WINDOW_MS / 1000)
+        while len(batch) < EMBED_BATCH_SIZE and not _embed_queue.empty():
+            batch.append(_embed_queue.get_nowait())
+        
+        items = [(image_path, decoded) for image_path, decoded, _ in batch]
+        try:
+            # Decode and inference are blocking, keep them off the event loop
+            dino_model, _ = get_model()
+            outcomes = await asyncio.to_thread(run_embedding_batch, dino_model, items)
+        except Exception as e:
+            outcomes = [e] * len(batch)
+        
+        for (_, _, future), outcome in zip(batch, outcomes):
+            if future.done():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+
+@app.on_event("startup")
+async def warmup():
+    """Start the batch worker and preprocessing pool, load the model and run one dummy forward pass"""
+    global _embed_queue, _batch_task, _preprocess_pool, _gpu_jpeg
+    _embed_queue = asyncio.Queue()
+    _batch_task = asyncio.create_task(batch_worker())
+    
+    load_index()
     
     dino_model, dino_processor = get_model()
+    if dino_model == "mock":
+        return
+    if EMBED_PREPROCESS_WORKERS > 0:
+        # spawn, not fork: the parent already holds CUDA state and threads
+        _preprocess_pool = ProcessPoolExecutor(
+            max_workers=EMBED_PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    try:
+        import torch
+        # Initialises the CUDA context, cuDNN algorithms and the compiled graph
+        device, dtype = model_device_dtype(dino_model)
+        _gpu_jpeg = device.type == "cuda"
+        crop = dino_processor.crop_size
+        forward_embeddings(dino_model, torch.zeros(1, 3, crop["height"], crop["width"], device=device, dtype=dtype))
+        logger.info("DINO model warmed up")
+    except Exception as e:
+        logger.warning(f"Warmup forward failed: {e}")
+
+
+@app.get("/health")
+async def health():
+    """Health check endpoint"""
+    return {"status": "healthy", "model_loaded": model is not None}
+
+
+async def embed_image(image_path: str):
+    """float32 embedding for an image path, via the batch worker (404 if missing)"""
+    if not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_path}")
+    
+    dino_model, _ = get_model()
     
     if dino_model == "mock":
         # Return mock embedding for development/testing
-        import random
-        embedding = [random.uniform(-1, 1) for _ in range(768)]
-        return EmbedResponse(embedding=embedding, dimensions=768)
+        import numpy as np
+        return np.random.uniform(-1, 1, 768).astype(np.float32)
     
     try:
-        import torch
-        from PIL import Image
-        
-        # Load and preprocess image
-        image = Image.open(request.image_path).convert("RGB")
-        inputs = dino_processor(images=image, return_tensors="pt")
-        
-        # Move to same device as model
-        device = next(dino_model.parameters()).device
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        # Get embedding
-        with torch.no_grad():
-            outputs = dino_model(**inputs)
-            # Use CLS token embedding
-            embedding = outputs.last_hidden_state[:, 0, :].squeeze().cpu().numpy().tolist()
-        
-        return EmbedResponse(embedding=embedding, dimensions=len(embedding))
+        loop = asyncio.get_running_loop()
+        decoded = None
+        # JPEGs on CUDA go straight to the batch worker's nvJPEG decode, skipping the pool
+        if _preprocess_pool is not None and not (_gpu_jpeg and is_jpeg(image_path)):
+            # Decode in a worker process while the GPU runs earlier batches
+            decoded = await loop.run_in_executor(_preprocess_pool, decode_to_shared_memory, image_path)
         
+        # Queue for the batch worker, which may share a forward pass with other requests
+        future = loop.create_future()
+        await _embed_queue.put((image_path, decoded, future))
+        return await future
     except Exception as e:
         logger.error(f"Embedding failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/embed", response_model=EmbedResponse)
+async def embed(request: EmbedRequest):
+    """
+    Compute visual embedding for an image
+    
+    Returns a 768-dimensional embedding vector
+    """
+    embedding = await embed_image(request.image_path)
+    # Skip response_model re-validation of every float
+    return DefaultResponse({"embedding": embedding.tolist(), "dimensions": len(embedding)})
+
+
+@app.post("/embed_bin")
+async def embed_bin(request: EmbedRequest):
+    """
+    Compute visual embedding for an image as raw bytes
+    
+    Body is the vector as little-endian float32 (4 * dimensions bytes);
+    decode with np.frombuffer(body, dtype="<f4").
+    """
+    embedding = await embed_image(request.image_path)
+    return Response(
+        content=embedding.astype("<f4", copy=False).tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Embedding-Dimensions": str(len(embedding))}
+    )
+
+
+@app.on_event("shutdown")
+async def persist_index():
+    """Stop the preprocessing pool; keep embeddings added through /index across restarts"""
+    if _preprocess_pool is not None:
+        _preprocess_pool.shutdown(cancel_futures=True)
+    try:
+        save_index()
+    except Exception as e:
+        logger.error(f"Failed to save search index: {e}")
+
+
+@app.post("/index")
+async def index_embedding(request: IndexRequest):
+    """Add an embedding to the similarity search index"""
+    try:
+        vectors = normalized(request.embedding)
+    except ImportError:
+        raise HTTPException(status_code=503, detail="faiss is not installed")
+    if search_index is not None and vectors.shape[1] != search_index.d:
+        raise HTTPException(status_code=400, detail=f"Expected {search_index.d} dimensions")
+    add_to_index([request.id], vectors)
+    return {"id": request.id, "count": len(index_ids)}
+
+
+@app.post("/search", response_model=SearchResponse)
+async def search(request: SearchRequest):
+    """
+    Find the stored embeddings most similar to a query embedding
+    
+    Scores are cosine similarities (vectors are L2-normalized on insert and query)
+    """
+    if search_index is None:
+        return SearchResponse(results=[])
+    if len(request.embedding) != search_index.d:
+        raise HTTPException(status_code=400, detail=f"Expected {search_index.d} dimensions")
+    
+    top_k = min(request.top_k, len(index_ids))
+    if top_k <= 0:
+        return SearchResponse(results=[])
+    scores, positions = search_index.search(normalized(request.embedding), top_k)
+    return SearchResponse(results=[
+        SearchResult(id=index_ids[pos], score=float(score))
+        for score, pos in zip(scores[0], positions[0])
+        if pos >= 0
+    ])
+
+
 @app.get("/info")
 async def info():
     """Get model info"""
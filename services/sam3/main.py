@@ -5,17 +5,24 @@ Precise element segmentation for complex UI (casino games, canvas elements)
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import os
 import logging
-import base64
-import io
-import tempfile
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# SIMD base64 for large screenshot payloads when available (same API as stdlib)
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 app = FastAPI(
     title="SAM-3 Segmentation Service",
     description="Precise UI element segmentation for AI UI Automation",
@@ -25,10 +32,108 @@ app = FastAPI(
 # Model loading (lazy initialization)
 sam_model = None
 sam_predictor = None
+# FP16 image encoder + autocast on CUDA (set once in get_model)
+USE_HALF = False
+# SAM_COMPILE=0 disables torch.compile of the image encoder on CUDA
+SAM_COMPILE = os.environ.get("SAM_COMPILE", "1") == "1"
+
+# LRU cache of image encoder outputs keyed by image digest, so repeated
+# prompts on the same screenshot only run the mask decoder
+EMBED_CACHE_SIZE = int(os.environ.get("SAM_EMBED_CACHE_SIZE", 16))
+_embed_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+_embed_cache_lock = threading.Lock()
+
+
+def set_image_pinned(predictor, image):
+    """
+    predictor.set_image, but uploading the resized frame from pinned memory
+    
+    Mirrors SamPredictor.set_image (RGB HWC uint8 in); the async copy is
+    queued on the same stream as the encoder, so no extra sync is needed.
+    """
+    import torch
+    input_image = predictor.transform.apply_image(image)
+    input_tensor = torch.from_numpy(input_image).permute(2, 0, 1).contiguous()[None, :, :, :]
+    if predictor.device.type == "cuda":
+        input_tensor = input_tensor.pin_memory().to(predictor.device, non_blocking=True)
+    else:
+        input_tensor = input_tensor.to(predictor.device)
+    predictor.set_torch_image(input_tensor, image.shape[:2])
+
+
+def set_image_from_bytes(predictor, image_data: bytes):
+    """Decode an encoded image and set it on predictor; JPEGs decode on GPU with nvJPEG"""
+    import torch
+    from torchvision.io import decode_image, decode_jpeg, ImageReadMode
+    
+    data = torch.frombuffer(bytearray(image_data), dtype=torch.uint8)
+    if predictor.device.type == "cuda" and image_data[:3] == b"\xff\xd8\xff":
+        try:
+            image = decode_jpeg(data, mode=ImageReadMode.RGB, device=predictor.device)
+        except (RuntimeError, ValueError) as e:
+            # JPEG variant nvJPEG can't handle (e.g. CMYK): use the CPU decoders below
+            logger.debug(f"nvJPEG decode failed, using CPU: {e}")
+        else:
+            input_tensor = predictor.transform.apply_image_torch(image[None].float())
+            predictor.set_torch_image(input_tensor, tuple(image.shape[1:]))
+            return
+    # PNG screenshots (and everything on CPU/MPS) decode with libpng/libjpeg on CPU
+    try:
+        image_array = decode_image(data, mode=ImageReadMode.RGB).permute(1, 2, 0).numpy()
+    except (RuntimeError, ValueError):
+        # Formats torchvision doesn't decode (BMP, TIFF, some palette PNGs) go through PIL
+        import io
+        import numpy as np
+        from PIL import Image
+        image_array = np.asarray(Image.open(io.BytesIO(image_data)).convert("RGB"))
+    set_image_pinned(predictor, image_array)
+
+
+def set_image_cached(predictor, digest: bytes, image_data: bytes) -> tuple:
+    """
+    Prepare predictor for the image with this digest, reusing cached features
+    
+    image_data is only decoded on a cache miss. Returns the (h, w) of the image.
+    """
+    with _embed_cache_lock:
+        cached = _embed_cache.get(digest)
+        if cached is not None:
+            _embed_cache.move_to_end(digest)
+    
+    if cached is not None:
+        predictor.features, predictor.original_size, predictor.input_size = cached
+        predictor.is_image_set = True
+        return predictor.original_size
+    
+    with sam_autocast():
+        set_image_from_bytes(predictor, image_data)
+    if EMBED_CACHE_SIZE > 0:
+        with _embed_cache_lock:
+            _embed_cache[digest] = (predictor.features, predictor.original_size, predictor.input_size)
+            _embed_cache.move_to_end(digest)
+            while len(_embed_cache) > EMBED_CACHE_SIZE:
+                _embed_cache.popitem(last=False)
+    return predictor.original_size
+
+
+def sam_autocast():
+    """FP16 autocast context on CUDA, no-op elsewhere"""
+    if not USE_HALF:
+        return contextlib.nullcontext()
+    import torch
+    return torch.autocast("cuda", dtype=torch.float16)
+
+
+def predict_masks(predictor, **prompt) -> tuple:
+    """Run predictor.predict under autocast; scores are returned as float32"""
+    with sam_autocast():
+        masks, scores, logits = predictor.predict(**prompt)
+    return masks, scores.astype("float32"), logits
+
 
 def get_model():
     """Lazy load SAM model"""
-    global sam_model, sam_predictor
+    global sam_model, sam_predictor, USE_HALF
     if sam_model is None:
         try:
             import torch
@@ -44,6 +149,18 @@ def get_model():
                 # Move to GPU if available
                 if torch.cuda.is_available():
                     sam_model = sam_model.cuda()
+                    # The ViT encoder dominates; FP16 halves its memory traffic. The small
+                    # prompt encoder / mask decoder keep FP32 weights and run under autocast.
+                    sam_model.image_encoder.half()
+                    USE_HALF = True
+                    # SamPredictor resizes the long side to 1024 and pads to 1024x1024, so the
+                    # encoder only ever sees one input shape: cuDNN autotuning and a
+                    # static-shape compile both pay off
+                    torch.backends.cudnn.benchmark = True
+                    if SAM_COMPILE:
+                        # Default mode, not reduce-overhead: CUDA graph outputs are reused
+                        # buffers and would corrupt the features held in the embedding cache
+                        sam_model.image_encoder = torch.compile(sam_model.image_encoder, dynamic=False)
                 elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
                     sam_model = sam_model.to('mps')
                 
@@ -76,15 +193,37 @@ class SegmentRequest(BaseModel):
     prompt_text: Optional[str] = None
     coarse_bbox: Optional[BBox] = None
     point: Optional[ClickPoint] = None  # Point prompt
+    # Score 3 candidate masks and keep the best (3x decoder cost; helps ambiguous points)
+    multimask_output: bool = False
 
 
 class SegmentResponse(BaseModel):
     mask_path: Optional[str] = None
-    mask: Optional[str] = None  # Base64 encoded mask
+    # Base64 of np.packbits(mask, axis=-1); decode with np.unpackbits(
+    # np.frombuffer(buf, np.uint8).reshape(h, -1), axis=-1, count=w)
+    mask: Optional[str] = None
+    mask_shape: Optional[List[int]] = None  # [h, w]
     click_point: ClickPoint
     confidence: Optional[float] = None
 
 
+@app.on_event("startup")
+async def warmup():
+    """Load the model and run the image encoder once on a blank frame"""
+    model, predictor = get_model()
+    if model == "mock":
+        return
+    try:
+        import numpy as np
+        # Initialises the CUDA context and cuDNN algorithms; not added to the embedding cache
+        with sam_autocast():
+            predictor.set_image(np.zeros((1024, 1024, 3), dtype=np.uint8))
+        predictor.reset_image()
+        logger.info("SAM model warmed up")
+    except Exception as e:
+        logger.warning(f"Warmup inference failed: {e}")
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
@@ -105,19 +244,15 @@ async def segment(request: SegmentRequest):
     Uses SAM for precise segmentation of complex UI elements
     """
     image_path = None
-    temp_file = None
+    image_data = None
+    digest = None
     
     try:
-        # Handle base64 image
+        # Handle base64 image (decoded in memory; the name only labels the mask file)
         if request.image:
-            from PIL import Image
             image_data = base64.b64decode(request.image)
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Save to temp file
-            temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            image.save(temp_file.name)
-            image_path = temp_file.name
+            digest = hashlib.blake2b(image_data, digest_size=16).digest()
+            image_path = f"b64_{digest.hex()}"
         elif request.image_path:
             if not os.path.exists(request.image_path):
                 raise HTTPException(status_code=404, detail=f"Image not found: {request.image_path}")
@@ -151,14 +286,14 @@ async def segment(request: SegmentRequest):
         
         import torch
         import numpy as np
-        from PIL import Image
-        
-        # Load image
-        image = Image.open(image_path).convert("RGB")
-        image_array = np.array(image)
+        import cv2
         
-        # Set image for predictor
-        predictor.set_image(image_array)
+        # Set image for predictor (encoder output is reused for repeat images)
+        if image_data is None:
+            with open(image_path, "rb") as f:
+                image_data = f.read()
+            digest = hashlib.blake2b(image_data, digest_size=16).digest()
+        h, w = set_image_cached(predictor, digest, image_data)
         
         # Prepare prompts
         if request.coarse_bbox:
@@ -169,57 +304,58 @@ async def segment(request: SegmentRequest):
                 request.coarse_bbox.x + request.coarse_bbox.w,
                 request.coarse_bbox.y + request.coarse_bbox.h
             ])
-            masks, scores, _ = predictor.predict(box=box, multimask_output=True)
+            masks, scores, _ = predict_masks(predictor, box=box, multimask_output=request.multimask_output)
         elif request.point:
             # Use point prompt
             point_coords = np.array([[request.point.x, request.point.y]])
             point_labels = np.array([1])
-            masks, scores, _ = predictor.predict(
+            masks, scores, _ = predict_masks(
+                predictor,
                 point_coords=point_coords,
                 point_labels=point_labels,
-                multimask_output=True
+                multimask_output=request.multimask_output
             )
         else:
             # Use center point as prompt
-            h, w = image_array.shape[:2]
             center_point = np.array([[w // 2, h // 2]])
             center_label = np.array([1])
-            masks, scores, _ = predictor.predict(
+            masks, scores, _ = predict_masks(
+                predictor,
                 point_coords=center_point,
                 point_labels=center_label,
-                multimask_output=True
+                multimask_output=request.multimask_output
             )
         
-        # Use best mask
+        # Use best mask (the only one unless multimask_output was requested)
         best_idx = np.argmax(scores)
         mask = masks[best_idx]
         confidence = float(scores[best_idx])
         
-        # Find centroid of mask for click point
-        y_coords, x_coords = np.where(mask)
-        if len(x_coords) > 0 and len(y_coords) > 0:
-            click_x = int(np.mean(x_coords))
-            click_y = int(np.mean(y_coords))
+        # Find centroid of mask for click point (image moments, one C pass)
+        mask_u8 = mask.astype(np.uint8) * 255
+        moments = cv2.moments(mask_u8, binaryImage=True)
+        if moments["m00"] > 0:
+            click_x = int(moments["m10"] / moments["m00"])
+            click_y = int(moments["m01"] / moments["m00"])
         else:
             # Fallback to bbox center
             if request.coarse_bbox:
                 click_x = request.coarse_bbox.x + request.coarse_bbox.w // 2
                 click_y = request.coarse_bbox.y + request.coarse_bbox.h // 2
             else:
-                click_x, click_y = image_array.shape[1] // 2, image_array.shape[0] // 2
+                click_x, click_y = w // 2, h // 2
         
-        # Save mask
-        mask_image = Image.fromarray((mask * 255).astype(np.uint8))
-        mask_image.save(mask_path)
+        # Save mask as PNG for debugging
+        cv2.imwrite(mask_path, mask_u8)
         
-        # Also return base64 encoded mask
-        buffer = io.BytesIO()
-        mask_image.save(buffer, format='PNG')
-        mask_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # Also return the mask bit-packed (1 bit per pixel, rows padded to a byte)
+        packed = np.packbits(mask, axis=-1)
+        mask_base64 = base64.b64encode(packed.tobytes()).decode('utf-8')
         
         return SegmentResponse(
             mask_path=mask_path,
             mask=mask_base64,
+            mask_shape=list(mask.shape),
             click_point=ClickPoint(x=click_x, y=click_y),
             confidence=confidence
         )
@@ -229,10 +365,6 @@ async def segment(request: SegmentRequest):
     except Exception as e:
         logger.error(f"Segmentation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Cleanup temp file
-        if temp_file and os.path.exists(temp_file.name):
-            os.unlink(temp_file.name)
 
 
 @app.get("/info")